@@ -1,4 +1,10 @@
 import argparse
+import copy
+import dataclasses
+
+# the default value of every argument, see ArgsConfig.get_defaults
+_DEFAULTS = None
+
 
 def str2bool(v):
     if isinstance(v, bool):
@@ -59,6 +65,19 @@ class ArgsConfig(object):
         parser.add_argument("--second_stage", type=int,
             help="the parameter set of the second stage experiments.")
 
+        # network
+        parser.add_argument("--net_type", type=str, default="random",
+            choices=["random", "fixed_degree", "small_world", "scale_free"],
+            help="random: random ties; fixed_degree: the same # of ties for everyone; small_world: Watts-Strogatz; scale_free: Barabasi-Albert (net_media sets the density).")
+        parser.add_argument("--ws_p", type=float, default=0.1,
+            help="(small_world) the rewiring probability of a tie.")
+        parser.add_argument("--net_seed", type=int, default=None,
+            help="(except random) the seed of the network, shared by the runs; derived from the run seed if not given.")
+        parser.add_argument("--net_cache", type=str, default=None,
+            help="(except random) load the generated networks from / save them to this directory.")
+        parser.add_argument("--net_file", type=str, default=None,
+            help="a directed edge list (text, .npy or .bin int32 pairs; .npz: a saved CSR) used instead of net_type; N is set to its number of nodes.")
+
         # models
         parser.add_argument("--n_steps", type=int, default=350,
             help="the number of individuals.")
@@ -66,8 +85,102 @@ class ArgsConfig(object):
             help="the number of runs.")
         parser.add_argument("--rnd_seed", type=int, default=664,
             help="random seed.")
+        parser.add_argument("--engine", type=str, default="object", choices=["object", "vector"],
+            help="object: one Agent object per individual; vector: struct-of-arrays engine for large N.")
+        parser.add_argument("--jit", type=str2bool, default=True,
+            help="(vector engine) run the asynchronous discussion pass in the numba kernel if numba is installed.")
+        parser.add_argument("--update_mode", type=str, default="async", choices=["async", "sync"],
+            help="async: shuffled discussions applied at once; sync: all the changes of a step applied together.")
+
+        # trajectory
+        parser.add_argument("--traj_dtype", type=str, default="float64", choices=["float32", "float64"],
+            help="the dtype of the recorded social opinions.")
+        parser.add_argument("--traj_stride", type=int, default=1,
+            help="record the social opinions every traj_stride steps.")
+        parser.add_argument("--traj_n_agents", type=int, default=None,
+            help="record the social opinions of this many (evenly spaced) agents only; all if not given.")
+        parser.add_argument("--traj_out", type=str, default=None,
+            help="stream the trajectories to memory-mapped .npy files in this directory instead of RAM.")
+        parser.add_argument("--traj_fields", type=str, default="soc_op",
+            help="comma-separated fields streamed with --traj_out: soc_op, decision, info.")
+        parser.add_argument("--traj_in", type=str, default=None,
+            help="(main.py) plot the trajectories streamed to this directory instead of simulating.")
+        parser.add_argument("--plot_mode", type=str, default="lines", choices=["lines", "density", "stats"],
+            help="(main.py) lines: one line per individual; density: a time x opinion heatmap for large N; stats: the --opinion_stats summaries.")
+
+        # opinion statistics
+        parser.add_argument("--opinion_stats", type=str2bool, default=False,
+            help="record per-step summaries of the opinions (histogram, mean/variance, quantiles, clusters; extremists vs moderates); with --traj_n_agents 0, nothing is O(N) per step in memory.")
+        parser.add_argument("--stats_bins", type=int, default=100,
+            help="(opinion_stats) the number of histogram bins.")
+        parser.add_argument("--stats_range", type=float, nargs=2, default=[-2.0, 2.0],
+            help="(opinion_stats) the opinion range of the histogram.")
+        parser.add_argument("--stats_out", type=str, default=None,
+            help="(opinion_stats) save the summaries to this .npz at the end of simulate.")
+
+        # early stopping
+        parser.add_argument("--early_stop", type=str, default="none", choices=["none", "frozen", "plateau"],
+            help="frozen: stop when no agent can change any more; plateau: stop when the informed/adopters ratios stop moving.")
+        parser.add_argument("--stop_window", type=int, default=20,
+            help="the number of steps over which the stopping criterion is checked.")
+        parser.add_argument("--stop_tol", type=float, default=1e-6,
+            help="(frozen) the max change of the opinions over the window.")
+        parser.add_argument("--stop_ratio_tol", type=float, default=0.0,
+            help="(plateau) the max change of the informed/adopters ratios over the window.")
+
+        # profiling
+        parser.add_argument("--profile_out", type=str, default=None,
+            help="time the phases of every step and count the discussion events, saved to this csv (off if not given).")
+
+        # checkpoint
+        parser.add_argument("--checkpoint_out", type=str, default=None,
+            help="save the complete state of the run to this .npz at the end of simulate (see --checkpoint_every).")
+        parser.add_argument("--checkpoint_every", type=int, default=0,
+            help="also save the checkpoint every this many steps (0: only at the end).")
+        parser.add_argument("--resume", type=str, default=None,
+            help="(main.py) continue the run saved in this checkpoint instead of starting a new one.")
+
+        # result cache
+        parser.add_argument("--cache_dir", type=str, default=None,
+            help="(main.py, sweep.py) reuse the runs stored in this directory and store the new ones (no cache if not given).")
+        parser.add_argument("--cache_traj", type=str2bool, default=True,
+            help="also store the recorded trajectory of the new runs in the cache.")
         
         self.parser = parser
+        self._cli_args = None
+
+
+    @staticmethod
+    def get_defaults() -> dict:
+        """ The default value of every argument (sys.argv is not parsed; computed once per process). """
+        global _DEFAULTS
+        if _DEFAULTS is None:
+            parser = ArgsConfig().parser
+            _DEFAULTS = {action.dest: action.default for action in parser._actions if action.dest != "help"}
+        return dict(_DEFAULTS)
+
+
+    @staticmethod
+    def from_dict(config, first_stage_int=None, second_stage_int=None) -> argparse.Namespace:
+        """
+        Build the args from the defaults updated with config (a dict or a
+        dataclass instance), without parsing sys.argv. If given, the stage
+        ints are then applied with set_config_first/set_config_second.
+        """
+        if dataclasses.is_dataclass(config):
+            config = dataclasses.asdict(config)
+        defaults = ArgsConfig.get_defaults()
+        unknown = set(config) - set(defaults)
+        if unknown:
+            raise ValueError("unknown arguments: {}.".format(", ".join(sorted(unknown))))
+
+        defaults.update(config)
+        args = argparse.Namespace(**defaults)
+        if first_stage_int is not None:
+            args = ArgsConfig.set_config_first(args, first_stage_int)
+        if second_stage_int is not None:
+            args = ArgsConfig.set_config_second(args, second_stage_int)
+        return args
 
 
     @staticmethod
@@ -176,9 +289,10 @@ class ArgsConfig(object):
         """ 
         Set the configuration with a given parameter set (dict) or
         an integer for the configuration (int).
+        sys.argv is only parsed on the first call.
         """
         
-        args = self.parser.parse_args()
+        args = self.get_cli_args()
         
         if first_param_dict is not None:
             args = self.set_config_first_dict(args, first_param_dict)
@@ -193,11 +307,18 @@ class ArgsConfig(object):
         return args
     
 
+    def get_cli_args(self) -> argparse.Namespace:
+        """ A copy of the command line args; sys.argv is only parsed on the first call. """
+        if self._cli_args is None:
+            self._cli_args = self.parser.parse_args()
+        return copy.copy(self._cli_args)
+
+
     def get_args(self):
         """
         Set the configuration with the given int in command line.
         """
-        args = self.parser.parse_args()
+        args = self.get_cli_args()
         if args.first_stage is None:
             raise ValueError("first_stage is not given.")
         if args.second_stage is None:
@@ -0,0 +1,167 @@
+import copy
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+from args import ArgsConfig
+from main import InnovationDiffusion
+
+# (first stage, second stage) pairs: the same stage with low and high net_media,
+# without (2, 3) and with (12, 13) extremists
+BENCH_STAGES = [(2, 3), (3, 3), (12, 3), (13, 3)]
+
+
+def _timed(f, *args) -> float:
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def _timed_init_ags(cls, args) -> tuple:
+    """ Build a new model of cls; return it and the time of the init_ags call of its __init__. """
+    init_ags, times = cls.init_ags, list()
+    def timed_init_ags(self):
+        start = time.perf_counter()
+        res = init_ags(self)
+        times.append(time.perf_counter() - start)
+        return res
+    cls.init_ags = timed_init_ags
+    try:
+        game = InnovationDiffusion(args, rnd_seed=args.rnd_seed, verbose=False)
+    finally:
+        cls.init_ags = init_ags
+    return game, times[0]
+
+
+def bench_case(args, n_repeats=20) -> dict:
+    """
+    Time the phases of one run of args separately.
+
+    1. __init__ (including init_ags), then init_ags alone (within the __init__ of a second model)
+    2. every simulate_step of the args.n_steps steps, on the second model
+    3. get_result and update_soc_op_dis, n_repeats calls each on the final state
+    4. the peak traced memory of __init__ + the steps, in a third run under tracemalloc
+    The trajectory is recorded as args asks (every agent by default).
+    """
+    start = time.perf_counter()
+    game = InnovationDiffusion(args, rnd_seed=args.rnd_seed, verbose=False)
+    init_s = time.perf_counter() - start
+
+    game, init_ags_s = _timed_init_ags(type(game), args)
+    step_s = np.array([_timed(game.simulate_step, t) for t in range(1, args.n_steps+1)])
+    get_result_s = min(_timed(game.get_result) for _ in range(n_repeats))
+    update_soc_op_dis_s = min(_timed(game.update_soc_op_dis, args.n_steps) for _ in range(n_repeats))
+    informed, adopters, not_concern = game.get_result()
+    del game
+
+    tracemalloc.start()
+    game = InnovationDiffusion(args, rnd_seed=args.rnd_seed, verbose=False)
+    for t in range(1, args.n_steps+1):
+        game.simulate_step(t)
+    peak_mem = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del game
+
+    return {
+        "N": args.N, "first_stage": args.first_stage, "second_stage": args.second_stage,
+        "traj_n_agents": args.N if args.traj_n_agents is None else min(args.traj_n_agents, args.N),
+        "net_media": args.net_media, "n_steps": args.n_steps,
+        "init_s": init_s, "init_ags_s": init_ags_s,
+        "step_s_mean": float(step_s.mean()), "step_s_median": float(np.median(step_s)),
+        "step_s_max": float(step_s.max()), "steps_per_s": float(args.n_steps / step_s.sum()),
+        "get_result_s": get_result_s, "update_soc_op_dis_s": update_soc_op_dis_s,
+        "peak_mem_mb": peak_mem / 2**20,
+        "result": {"informed": float(informed), "adopters": float(adopters), "not_concern": float(not_concern)},
+    }
+
+
+def get_meta(args) -> dict:
+    """ What is needed to compare two benchmark files: the code version, the machine and the shared args. """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "numpy": np.__version__, "machine": platform.platform(),
+        "engine": args.engine, "jit": args.jit, "update_mode": args.update_mode,
+        "n_steps": args.n_steps, "rnd_seed": args.rnd_seed, "traj_n_agents": args.traj_n_agents,
+    }
+
+
+def run_bench(args, Ns=(1000, 10000, 100000), stages=BENCH_STAGES, verbose=True) -> dict:
+    """ Benchmark every (N, stage) case of args and return {"meta": ..., "cases": [...]}. """
+    # warm up (imports, numba compilation) outside of the timed cases
+    warmup_args = copy.copy(args)
+    warmup_args.N, warmup_args.n_steps = 100, 5
+    bench_case(ArgsConfig.set_config_second(ArgsConfig.set_config_first(warmup_args, 3), 3), n_repeats=1)
+
+    cases = list()
+    for N in Ns:
+        for first, second in stages:
+            case_args = ArgsConfig.set_config_second(ArgsConfig.set_config_first(copy.copy(args), first), second)
+            case_args.N = int(N)
+            case = bench_case(case_args)
+            cases.append(case)
+            if verbose:
+                print("| N {:>6} | first {:>2} second {} ({:>4}) | init: {:.3f}s; {:.1f} steps/s; peak mem: {:.1f}MB".format(
+                    case["N"], first, second, case["net_media"], case["init_s"],
+                    case["steps_per_s"], case["peak_mem_mb"]))
+    return {"meta": get_meta(args), "cases": cases}
+
+
+def compare(old:dict, new:dict, tol=0.1) -> list:
+    """
+    Match the cases of two benchmark results on (N, first_stage, second_stage,
+    the number of recorded agents).
+    Return the cases whose steps/s dropped or peak memory grew by more than tol (relative).
+    """
+    key = lambda case: (case["N"], case["first_stage"], case["second_stage"], case.get("traj_n_agents", case["N"]))
+    old_cases = {key(case): case for case in old["cases"]}
+    regressions = list()
+    for case in new["cases"]:
+        if key(case) not in old_cases:
+            continue
+        prev = old_cases[key(case)]
+        speed = case["steps_per_s"] / prev["steps_per_s"]
+        mem = case["peak_mem_mb"] / max(prev["peak_mem_mb"], 1e-9)
+        if speed < 1 - tol or mem > 1 + tol:
+            regressions.append({"N": case["N"], "first_stage": case["first_stage"],
+                "second_stage": case["second_stage"], "speed_ratio": speed, "mem_ratio": mem})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgsConfig()
+    parser.parser.set_defaults(n_steps=50)
+    parser.parser.add_argument("--bench_N", type=int, nargs="+", default=[1000, 10000, 100000],
+        help="(bench) the population sizes to run.")
+    parser.parser.add_argument("--bench_stages", type=str, default=None,
+        help="(bench) a json list of [first, second] stage pairs; BENCH_STAGES if not given.")
+    parser.parser.add_argument("--compare", type=str, default=None,
+        help="(bench) a previous benchmark json to check the new results against.")
+    parser.parser.add_argument("--compare_tol", type=float, default=0.1,
+        help="(bench) the relative slowdown or memory growth reported as a regression.")
+    parser.parser.add_argument("--out", type=str, default="bench_results.json",
+        help="(bench) the output json.")
+    args = parser.parser.parse_args()
+
+    stages = BENCH_STAGES if args.bench_stages is None else [tuple(s) for s in json.loads(args.bench_stages)]
+    res = run_bench(args, args.bench_N, stages)
+    with open(args.out, "w") as f:
+        json.dump(res, f, indent=2)
+    print("benchmark save to {}".format(args.out))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), res, tol=args.compare_tol)
+        for reg in regressions:
+            print("| regression | N {} first {} second {} | steps/s x{:.2f}; peak mem x{:.2f}".format(
+                reg["N"], reg["first_stage"], reg["second_stage"], reg["speed_ratio"], reg["mem_ratio"]))
+        if not regressions:
+            print("no regression against {}".format(args.compare))
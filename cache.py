@@ -0,0 +1,149 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+from args import ArgsConfig
+from recorder import TrajectoryRecorder
+
+# the args that do not change the simulated run (output, plotting and
+# execution options), left out of the cache key
+NON_MODEL_ARGS = ("n_runs", "jit", "traj_dtype", "traj_stride", "traj_n_agents", "traj_out", "traj_fields",
+                  "traj_in", "plot_mode", "profile_out", "checkpoint_out", "checkpoint_every", "resume",
+                  "cache_dir", "cache_traj", "net_cache", "opinion_stats", "stats_bins", "stats_range", "stats_out")
+
+# file_digest results, by (path, size, mtime)
+_FILE_DIGESTS = dict()
+
+
+def seed_to_json(rnd_seed):
+    """ An int seed as is, a np.random.SeedSequence as its entropy and spawn key. """
+    if isinstance(rnd_seed, np.random.SeedSequence):
+        return {"entropy": rnd_seed.entropy, "spawn_key": list(rnd_seed.spawn_key)}
+    return int(rnd_seed)
+
+
+def file_digest(path:str) -> str:
+    """ The sha256 of the content of the file path, computed once per process for each (path, size, mtime). """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _FILE_DIGESTS:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                digest.update(block)
+        _FILE_DIGESTS[key] = digest.hexdigest()
+    return _FILE_DIGESTS[key]
+
+
+def config_key(args, rnd_seed, version) -> str:
+    """
+    The sha256 of the model args (every ArgsConfig field but NON_MODEL_ARGS;
+    net_file by the sha256 of its content, not its path), the seed and the
+    model version, so that equal runs get equal keys.
+    """
+    config = {name: getattr(args, name, default) for name, default in ArgsConfig.get_defaults().items()
+              if name not in NON_MODEL_ARGS}
+    if getattr(args, "net_file", None) is not None:
+        config["net_file"] = file_digest(args.net_file)
+    content = json.dumps({"args": config, "rnd_seed": seed_to_json(rnd_seed), "version": version},
+        sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ResultStore(object):
+    """
+    Persistent store of finished runs in root, keyed by config_key. A run is
+    a directory of .npy columns: the get_result ratios, the per-step
+    population counts and, optionally, the recorded trajectory (soc_op,
+    steps, agent_idx, is_extrem), with a meta.json. Entries are written to a
+    temporary directory and renamed, so concurrent workers never read a partial entry.
+    """
+
+    def __init__(self, root:str, version) -> None:
+        super().__init__()
+        self.root = root
+        self.version = version
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def from_args(args, version) -> "ResultStore":
+        if args.cache_dir is None:
+            return None
+        return ResultStore(args.cache_dir, version)
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, args, rnd_seed, with_traj=False) -> dict:
+        """
+        Return the cached run of (args, rnd_seed), or None if it is not stored
+        (or, with_traj, if its trajectory is missing or not recorded as args asks).
+        The dict holds "result", "counts", "columns", "stop_step", "meta"
+        and, with_traj, the memory-mapped "soc_op" with "steps", "agent_idx", "is_extrem".
+        """
+        path = self._path(config_key(args, rnd_seed, self.version))
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        res = {"meta": meta, "result": tuple(np.load(os.path.join(path, "result.npy")).tolist()),
+               "counts": np.load(os.path.join(path, "counts.npy")),
+               "columns": meta["columns"], "stop_step": meta["stop_step"]}
+        if not with_traj:
+            return res
+
+        if not meta["has_traj"] or meta["traj_stride"] != args.traj_stride:
+            return None
+        agent_idx = np.load(os.path.join(path, "agent_idx.npy"))
+        # the N of the run (set by args.net_file, if given)
+        run_args = copy.copy(args)
+        run_args.N = meta.get("n_agents", args.N)
+        expected = TrajectoryRecorder.agent_idx_from_args(run_args)
+        expected = np.arange(run_args.N) if expected is None else expected
+        if not np.array_equal(agent_idx, expected):
+            return None
+        res["soc_op"] = np.load(os.path.join(path, "soc_op.npy"), mmap_mode="r")
+        res["steps"] = np.load(os.path.join(path, "steps.npy"))
+        res["agent_idx"] = agent_idx
+        res["is_extrem"] = np.load(os.path.join(path, "is_extrem.npy"))
+        return res
+
+    def put(self, args, rnd_seed, model, with_traj=True) -> None:
+        """ Store the finished run model of (args, rnd_seed), with its trajectory if with_traj and recorded. """
+        key = config_key(args, rnd_seed, self.version)
+        path = self._path(key)
+        with_traj = with_traj and model.recorder.n_cols > 0
+        tmp_path = os.path.join(self.root, "tmp-{}-{}".format(key, os.getpid()))
+        os.makedirs(tmp_path, exist_ok=True)
+
+        np.save(os.path.join(tmp_path, "result.npy"), np.array(model.get_result(), dtype=float))
+        np.save(os.path.join(tmp_path, "counts.npy"), model.counter.get_series())
+        if with_traj:
+            np.save(os.path.join(tmp_path, "soc_op.npy"), model.recorder.get())
+            np.save(os.path.join(tmp_path, "steps.npy"), model.recorder.get_steps())
+            np.save(os.path.join(tmp_path, "agent_idx.npy"), model.recorder.get_agent_idx())
+            np.save(os.path.join(tmp_path, "is_extrem.npy"), model.recorder.is_extrem)
+        meta = {
+            "key": key, "version": self.version, "rnd_seed": seed_to_json(rnd_seed),
+            "args": {name: value for name, value in vars(args).items() if name not in NON_MODEL_ARGS},
+            "columns": model.counter.columns, "stop_step": model.stop_step, "n_agents": model.args.N,
+            "has_traj": with_traj, "traj_stride": args.traj_stride, "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2, default=str)
+
+        # replace an older entry (e.g. stored without its trajectory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another worker stored the same run meanwhile
+            shutil.rmtree(tmp_path, ignore_errors=True)
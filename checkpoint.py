@@ -0,0 +1,53 @@
+import argparse
+import json
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+
+def prefixed(prefix:str, state:dict) -> dict:
+    """ Namespace the keys of a component state ("counter", "traj", ...) in the checkpoint. """
+    return {prefix+"."+name: value for name, value in state.items()}
+
+
+def unprefixed(prefix:str, state:dict) -> dict:
+    """ The state of the component prefix, without the prefix. """
+    n = len(prefix) + 1
+    return {name[n:]: value for name, value in state.items() if name.startswith(prefix+".")}
+
+
+def pack_queues(queues:list) -> dict:
+    """ The discussion queues {t0_rd: count} of the agents as flat (agent, t0_rd, count) arrays. """
+    agent = [ag_idx for ag_idx, queue in enumerate(queues) for _ in queue]
+    t0_rd = [t0 for queue in queues for t0 in queue]
+    count = [c for queue in queues for c in queue.values()]
+    return {"agent": np.array(agent, dtype=np.int64), "t0_rd": np.array(t0_rd, dtype=np.int64),
+            "count": np.array(count, dtype=np.int64)}
+
+
+def unpack_queues(state:dict, n_agents:int) -> list:
+    queues = [dict() for _ in range(n_agents)]
+    for ag_idx, t0, count in zip(state["agent"].tolist(), state["t0_rd"].tolist(), state["count"].tolist()):
+        queues[ag_idx][t0] = count
+    return queues
+
+
+def save_checkpoint(path:str, model_name:str, args, state:dict) -> None:
+    """
+    Write the state (dict of arrays) of a run of the model class model_name
+    with args to path, as a compressed .npz (np.savez appends the suffix if missing).
+    """
+    np.savez_compressed(path, _version=np.array(CHECKPOINT_VERSION), _model=np.array(model_name),
+        _args=np.array(json.dumps(vars(args))), **state)
+
+
+def load_checkpoint(path:str) -> tuple:
+    """ Return the model class name, the args and the state saved by save_checkpoint. """
+    with np.load(path) as f:
+        state = {name: f[name] for name in f.files}
+    version = int(state.pop("_version"))
+    if version != CHECKPOINT_VERSION:
+        raise ValueError("checkpoint version {} is not supported (expected {}).".format(version, CHECKPOINT_VERSION))
+    model_name = str(state.pop("_model"))
+    args = argparse.Namespace(**json.loads(str(state.pop("_args"))))
+    return model_name, args, state
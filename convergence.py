@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class ConvergenceMonitor(object):
+    """
+    Stopping criterion for InnovationDiffusion.simulate, checked every
+    window steps against the state saved at the previous check.
+
+    mode "frozen": the opinions moved less than op_tol over the window and
+        no agent can change state any more (no pending discussion-queue
+        entries, no possible media-triggered transition).
+    mode "plateau": the informed/adopters ratios moved at most ratio_tol
+        over the window (the opinions may still move).
+    """
+
+    MODES = ("none", "frozen", "plateau")
+
+    def __init__(self, mode="frozen", window=20, op_tol=1e-6, ratio_tol=0.0) -> None:
+        super().__init__()
+
+        if mode not in self.MODES[1:]:
+            raise ValueError("mode should be in {}.".format(self.MODES[1:]))
+        if window < 1:
+            raise ValueError("window should be >= 1.")
+
+        self.mode = mode
+        self.window = window
+        self.op_tol = op_tol
+        self.ratio_tol = ratio_tol
+
+        self._soc_op = None
+        self._ratios = None
+
+    @staticmethod
+    def from_args(args) -> "ConvergenceMonitor":
+        if args.early_stop == "none":
+            return None
+        return ConvergenceMonitor(args.early_stop, window=args.stop_window,
+            op_tol=args.stop_tol, ratio_tol=args.stop_ratio_tol)
+
+    def get_state(self) -> dict:
+        """ The state saved at the previous check (if any). """
+        state = {"soc_op": self._soc_op, "ratios": self._ratios}
+        return {name: value for name, value in state.items() if value is not None}
+
+    def set_state(self, state:dict) -> None:
+        self._soc_op = state.get("soc_op")
+        self._ratios = state.get("ratios")
+
+    def update(self, timestep, model) -> bool:
+        """ Return True if the run of model has converged at timestep. """
+        if timestep % self.window != 0:
+            return False
+
+        if self.mode == "frozen":
+            soc_op = np.array(model.get_soc_op(), dtype=float)
+            prev, self._soc_op = self._soc_op, soc_op
+            if prev is None or np.max(np.abs(soc_op - prev), initial=0.0) >= self.op_tol:
+                return False
+            return not model.has_pending_transitions()
+
+        # the informed and adopters ratios
+        ratios = np.array(model.get_result()[:2], dtype=float)
+        prev, self._ratios = self._ratios, ratios
+        return prev is not None and np.max(np.abs(ratios - prev)) <= self.ratio_tol
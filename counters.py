@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class PopulationCounter(object):
+    """
+    Live population counts, updated on each state transition: the informed
+    agents and the agents in each decision and interest state.
+    record(timestep) saves them in a per-step time series.
+    """
+
+    def __init__(self, n_agents:int, n_steps:int, decisions:dict, interests:dict,
+        init_decision=-1, init_interest=None) -> None:
+        """ decisions/interests map the names of the states to their values. """
+        super().__init__()
+        self.n_agents = n_agents
+
+        # every agent starts in (init_decision, init_interest), not informed
+        self.informed = 0
+        self.decision = {state: 0 for state in decisions.values()}
+        self.decision[init_decision] = n_agents
+        self.interest = {state: 0 for state in interests.values()}
+        self.interest[init_interest] = n_agents
+
+        self.columns = ["informed"] + list(decisions.keys()) + list(interests.keys())
+        self._states = (list(decisions.values()), list(interests.values()))
+        self.series = np.zeros((n_steps+1, len(self.columns)), dtype=np.int64)
+        self.n_recorded = 0
+
+    def add_informed(self, n=1) -> None:
+        self.informed += n
+
+    def move(self, old_decision, new_decision, old_interest, new_interest) -> None:
+        """ One agent moved from (old_decision, old_interest) to (new_decision, new_interest). """
+        if old_decision != new_decision:
+            self.decision[old_decision] -= 1
+            self.decision[new_decision] += 1
+        if old_interest != new_interest:
+            self.interest[old_interest] -= 1
+            self.interest[new_interest] += 1
+
+    def move_many(self, old_decision, new_decision, old_interest, new_interest) -> None:
+        """ Batched move, for arrays of the old and new states of the moved agents. """
+        for counts, old, new in ((self.decision, old_decision, new_decision),
+                                 (self.interest, old_interest, new_interest)):
+            changed = old != new
+            if not changed.any():
+                continue
+            for state, n in zip(*np.unique(old[changed], return_counts=True)):
+                counts[state.item()] -= int(n)
+            for state, n in zip(*np.unique(new[changed], return_counts=True)):
+                counts[state.item()] += int(n)
+
+    def get_counts(self) -> np.ndarray:
+        decisions, interests = self._states
+        return np.array([self.informed] + [self.decision[s] for s in decisions] + [self.interest[s] for s in interests])
+
+    def record(self, timestep) -> None:
+        self.series[timestep] = self.get_counts()
+        self.n_recorded = timestep + 1
+
+    def fill_to_end(self) -> None:
+        """ Repeat the last recorded counts in the remaining steps (e.g. after an early stop). """
+        if self.n_recorded == 0:
+            return
+        self.series[self.n_recorded:] = self.series[self.n_recorded-1]
+        self.n_recorded = self.series.shape[0]
+
+    def get_state(self) -> dict:
+        return {"informed": np.array(self.informed), "decision": np.array(list(self.decision.values())),
+                "interest": np.array(list(self.interest.values())), "series": self.series[:self.n_recorded]}
+
+    def set_state(self, state:dict) -> None:
+        """ Restore the counts of get_state (the series may be shorter than n_steps+1). """
+        series = state["series"]
+        if series.shape[0] > self.series.shape[0]:
+            raise ValueError("the series has more steps than n_steps+1.")
+        self.informed = int(state["informed"])
+        self.decision = dict(zip(self.decision, state["decision"].tolist()))
+        self.interest = dict(zip(self.interest, state["interest"].tolist()))
+        self.series[:series.shape[0]] = series
+        self.n_recorded = series.shape[0]
+
+    def get_series(self) -> np.ndarray:
+        """ Return the (n_recorded_steps, len(self.columns)) counts. """
+        return self.series[:self.n_recorded]
@@ -1,11 +1,4 @@
 #!/bin/bash
-for fir in 15
-do
-    sec=0
-    while [ "$sec" -lt 8 ]
-    do
-        echo "running fir ${fir} sec ${sec}"
-        python3 main.py --first_stage ${fir} --second_stage ${sec} --n_steps 170
-        sec=$(( sec + 1 ))
-    done
-done
+# run every second stage configuration of the given first stages,
+# --n_runs seeds each, on all the cores (see sweep.py)
+python3 sweep.py --first_stages 15 --n_steps 170 --out first_stage_results.csv "$@"
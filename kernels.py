@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def _discuss_pass(src, dst, omega_draws, soc_op, soc_U, info, info_request, mu):
+    """
+    Asynchronous discussion pass over flat arrays: process the contacts
+    src[k] -> dst[k] in order, every change being visible to the later ones.
+    soc_op, soc_U and info are updated in place. omega_draws[k] is whether
+    the k-th contact transmits the information if it can.
+    Return the ids of the agents that got informed, in order, and the
+    number of influence updates applied.
+    """
+    new_info = np.empty(src.shape[0], dtype=np.int64)
+    n_new = 0
+    n_infl = 0
+    for k in range(src.shape[0]):
+        i = src[k]
+        j = dst[k]
+
+        # social influence
+        op_i, U_i, op_j, U_j = soc_op[i], soc_U[i], soc_op[j], soc_U[j]
+        h_ij = min(op_i+U_i, op_j+U_j) - max(op_i-U_i, op_j-U_j)
+        if h_ij > U_i:
+            soc_op[j] = op_j + mu * (h_ij/U_i - 1) * (op_i - op_j)
+            soc_U[j] = U_j + mu * (h_ij/U_i - 1) * (U_i - U_j)
+            n_infl += 1
+
+        # receive information from other agent
+        if info[i] and (not info[j] and info_request[j]):
+            if omega_draws[k]:
+                info[j] = True
+                new_info[n_new] = j
+                n_new += 1
+    return new_info[:n_new], n_infl
+
+
+_discuss_pass_jit = False
+
+
+def get_discuss_pass():
+    """
+    Return the compiled discussion pass, or None if numba is not installed.
+    numba is only imported on the first call, so that importing the model stays cheap.
+    """
+    global _discuss_pass_jit
+    if _discuss_pass_jit is False:
+        try:
+            import numba
+            _discuss_pass_jit = numba.njit(cache=True, nogil=True)(_discuss_pass)
+        except ImportError:
+            _discuss_pass_jit = None
+    return _discuss_pass_jit
@@ -1,9 +1,26 @@
 import argparse
+import collections
+import copy
+import hashlib
 import itertools
+import json
+import os
 import numpy as np
 
 from args import ArgsConfig
-from plot import PlotLinesHandler
+from network import CSRNetwork
+from recorder import TrajectoryRecorder, OpinionStatsRecorder, load_trajectory
+from rng import RandomPool, get_rng_state, set_rng_state, derive_seed
+from scheduler import ActiveSet
+from convergence import ConvergenceMonitor
+from counters import PopulationCounter
+from profiler import StepProfiler
+from checkpoint import prefixed, unprefixed, pack_queues, unpack_queues, save_checkpoint, load_checkpoint
+from cache import ResultStore, seed_to_json, file_digest
+import kernels
+
+# bump when a change alters the run of a given args and seed (the cached results are then recomputed)
+MODEL_VERSION = 1
 
 # testing ssh key to Github with new laptop
 
@@ -22,18 +39,28 @@ class Agent:
     MAYBE = 12
     YES = 13
 
-    def __init__(self, args: argparse.ArgumentParser) -> None:
+    # state names (for the population counts)
+    DECISIONS = {"not_concerned": NOT_CONCERNED, "info_request": INFO_REQUEST, "no_adoption": NO_ADOPTION,
+                 "pre_adoption": PRE_ADOPTION, "adoption": ADOPTION}
+    INTERESTS = {"no": NO, "maybe": MAYBE, "yes": YES}
+
+    def __init__(self, args: argparse.ArgumentParser, rnd: RandomPool, counter: PopulationCounter) -> None:
         self.id = next(self._ids)
         self.args = args
+        self.rnd = rnd
+        self.counter = counter
 
-        self.net = list()
+        # ids of the out-neighbors (a view on the CSRNetwork indices) and
+        # the population they index into
+        self.net = np.zeros(0, dtype=np.int32)
+        self.ags = list()
         self.is_extrem = False
 
-        # discussion-to-propagate queue
-        self.t0_rd_queue = list()
+        # discussion-to-propagate queue, as a multiset {t0_rd: count}
+        self.t0_rd_queue = dict()
 
         ## buffer for getting new information to propagate through discussion
-        self.t0_rd_queue_new = list()
+        self.t0_rd_queue_new = dict()
 
         ## buffer for getting information through discussion
         self.get_info_discussion = False
@@ -52,6 +79,7 @@ class Agent:
         """
         if self.decision == Agent.ADOPTION:
             return
+        old_decision, old_interest = self.decision, self.interest
 
         # 1.
         if self.ind_benefit is None:
@@ -88,11 +116,13 @@ class Agent:
                     self.decision = Agent.PRE_ADOPTION
                     if self.yes_rd is None:
                         self.yes_rd = timestep
+
+        self.counter.move(old_decision, self.decision, old_interest, self.interest)
     
 
     def _setup_state_variables(self, args):
         # social opinion
-        self.soc_op = np.random.normal(loc=args.m_s, scale=args.sd_s)
+        self.soc_op = self.rnd.normal(loc=args.m_s, scale=args.sd_s)
         self.soc_U = args.U_s
 
         ## buffer for the changes during disccusion
@@ -106,72 +136,107 @@ class Agent:
         # information
         self.info = False
 
-        # decision
+        # interest, decision
+        self.interest = None
         self.decision = -1
 
         # update other dependent variables
         self._update_status(timestep=0)
         
 
-    @staticmethod
-    def _draw(p) -> bool:
-        return True if np.random.uniform() < p else False
+    def _draw(self, p) -> bool:
+        return True if self.rnd.uniform() < p else False
     
 
     def _get_info_and_evaluate_benefit(self):
+        if not self.info:
+            self.counter.add_informed()
         self.info = True
-        self.ind_benefit = np.random.normal(loc=self.args.m_i, scale=self.args.sd_i)
+        self.ind_benefit = self.rnd.normal(loc=self.args.m_i, scale=self.args.sd_i)
         self.ind_U = self.args.U_i
 
 
-    def receive_info_media(self, timestep):
-        if self.args.net_media == "low":
+    @staticmethod
+    def get_media_p(args) -> float:
+        """ The probability to receive information from the media in a timestep. """
+        if args.net_media == "low":
             p = 0.1
-        elif self.args.net_media == "high":
+        elif args.net_media == "high":
             p = 0.4
-        
-        if self._draw(p):
+        return p
+
+
+    def receive_info_media(self, timestep, u: float):
+        """ u is this agent's U[0, 1) draw of the media step (drawn for all agents at once). """
+        if u < self.get_media_p(self.args):
             # receive information
             if not self.info and self.decision == Agent.INFO_REQUEST:
                 self._get_info_and_evaluate_benefit()
                 self._update_status(timestep)
 
-            self.t0_rd_queue.append(timestep)
+            self.t0_rd_queue[timestep] = self.t0_rd_queue.get(timestep, 0) + 1
     
 
-    def discuss(self, timestep):
-        while len(self.t0_rd_queue):
-            t0_rd = self.t0_rd_queue.pop(0)
+    def discuss(self, timestep, profiler: StepProfiler=None):
+        """
+        The count duplicates of a t0_rd in the queue are discussed with one
+        combined sample of neighbors. The entries pushed to the neighbors are
+        dropped if they would be expired when discussed (next timestep).
+
+        In the synchronous mode the changes are buffered until update(); in
+        the asynchronous mode they are applied at once, and the entries pushed
+        to the neighbors are never discussed, so they are not kept.
+        The contacts, influence updates and information transfers are added to profiler if given.
+        """
+        sync = self.args.update_mode == "sync"
+        queue, self.t0_rd_queue = self.t0_rd_queue, dict()
+        n_contacts, n_infl, n_omega = 0, 0, 0
+        for t0_rd, count in sorted(queue.items()):
             proportion = max(1-self.args.gamma*(timestep-t0_rd), 0)
             n_to_discuss = round(len(self.net)*proportion)
             if n_to_discuss == 0:
                 continue
+            to_propagate = sync and 1-self.args.gamma*(timestep+1-t0_rd) > 0
             
             # to discuss to a proportion of neighbors
             # (direction: self -> ag)
-            chosen_ags = [self.net[i] for i in np.random.choice(np.arange(len(self.net)), size=n_to_discuss)]
+            chosen_ags = [self.ags[i] for i in self.net[self.rnd.rng.integers(len(self.net), size=count*n_to_discuss)]]
+            n_contacts += len(chosen_ags)
             for ag in chosen_ags:
                 # social influence
                 h_ij = min(self.soc_op+self.soc_U, ag.soc_op+ag.soc_U) - max(self.soc_op-self.soc_U, ag.soc_op-ag.soc_U)
                 if h_ij > self.soc_U:
-                    # synchronous
-                    # ag.soc_op_delta += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_op - ag.soc_op)
-                    # ag.soc_U_delta += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_U - ag.soc_U)
-
-                    # asynchronous
-                    ag.soc_op += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_op - ag.soc_op)
-                    ag.soc_U += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_U - ag.soc_U)
+                    n_infl += 1
+                    if sync:
+                        ag.soc_op_delta += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_op - ag.soc_op)
+                        ag.soc_U_delta += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_U - ag.soc_U)
+                    else:
+                        ag.soc_op += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_op - ag.soc_op)
+                        ag.soc_U += self.args.mu * (h_ij/self.soc_U - 1) * (self.soc_U - ag.soc_U)
                 
                 # receive information from other agent
                 if self.info and (not ag.info and ag.decision == Agent.INFO_REQUEST):
                     if self._draw(self.args.omega):
-                        # synchronous
-                        # ag.get_info_discussion = True
-                        
-                        # asychronous
-                        ag._get_info_and_evaluate_benefit()
+                        n_omega += 1
+                        if sync:
+                            ag.get_info_discussion = True
+                        else:
+                            ag._get_info_and_evaluate_benefit()
                 
-                ag.t0_rd_queue_new.append(t0_rd)
+                if to_propagate:
+                    if t0_rd not in ag.t0_rd_queue_new:
+                        ag.drop_expired(ag.t0_rd_queue_new, timestep+1)
+                        ag.t0_rd_queue_new[t0_rd] = 0
+                    ag.t0_rd_queue_new[t0_rd] += 1
+
+        if profiler is not None:
+            profiler.add(contacts=n_contacts, influence=n_infl, omega=n_omega)
+    
+
+    def drop_expired(self, queue: dict, timestep) -> None:
+        """ Drop in bulk the t0_rd (with all their duplicates) for which 1-gamma*(timestep-t0_rd) <= 0. """
+        for t0_rd in [t0_rd for t0_rd in queue if 1-self.args.gamma*(timestep-t0_rd) <= 0]:
+            del queue[t0_rd]
     
 
     def update(self, timestep):
@@ -181,7 +246,7 @@ class Agent:
         self.soc_U_delta = 0
 
         self.t0_rd_queue = self.t0_rd_queue_new
-        self.t0_rd_queue_new = list()
+        self.t0_rd_queue_new = dict()
 
         if self.get_info_discussion:
             self._get_info_and_evaluate_benefit()
@@ -190,43 +255,145 @@ class Agent:
         self._update_status(timestep)
 
 
+# what simulate_iter yields after each step: the population counts follow
+# counter.columns, result is get_result() and soc_op is None or a read-only view
+StepSnapshot = collections.namedtuple("StepSnapshot", ["timestep", "counts", "result", "soc_op"])
+
+
 class InnovationDiffusion(object):
 
+    def __new__(cls, args: argparse.ArgumentParser, rnd_seed: int, verbose=True, **kwargs):
+        """ Dispatch to the struct-of-arrays engine when args.engine == "vector". """
+        if cls is InnovationDiffusion and getattr(args, "engine", "object") == "vector":
+            cls = VecInnovationDiffusion
+        return super().__new__(cls)
+
+
     def __init__(self, args: argparse.ArgumentParser, rnd_seed: int, verbose=True) -> None:
+        """ rnd_seed is an int or a np.random.SeedSequence (e.g. from rng.spawn_seeds). """
         super().__init__()
         Agent._ids = itertools.count(0)
-        np.random.seed(rnd_seed)
+        self.rnd_seed = rnd_seed
+        self.rng = np.random.default_rng(rnd_seed)
+        self.rnd = RandomPool(self.rng)
 
         self.verbose = verbose
-        self.args = args
+        self.args = args = self.use_net_file(args)
         if self.verbose:
             print("Args: {}".format(args))
 
+        self.counter = PopulationCounter(args.N, args.n_steps, Agent.DECISIONS, Agent.INTERESTS)
         self.ags = self.init_ags()
+        self.active = ActiveSet(args.N)
+        self.counter.record(0)
+        self.profiler = StepProfiler.from_args(args)
+        self.monitor = ConvergenceMonitor.from_args(args)
+        self.timestep, self.stop_step = 0, None
 
         # social opinions distribution
-        self.soc_op_dis = np.array([[ag.soc_op for ag in self.ags]])
+        self.recorder = TrajectoryRecorder.from_args(args)
+        self.recorder.set_is_extrem(self.get_is_extrem())
+        self.stats = OpinionStatsRecorder.from_args(args)
+        if self.stats is not None:
+            self.stats.set_is_extrem(self.get_is_extrem())
+        self.update_soc_op_dis(timestep=0)
     
 
     @staticmethod
-    def get_randint(low, high, exclude, size:int) -> list:
-        """ Sample from [low, high). Return a list of ints. """
-        ctr = 0
-        s = np.zeros(high)
-        s[exclude] = 1.0
-        ans = list()
-        while ctr < min(size, high-low):
-            chosen_ag = np.random.randint(low, high)
-            if s[chosen_ag] == 0.0:
-                ans.append(chosen_ag)
-                s[chosen_ag] = 1.0
-                ctr += 1
-        return ans
+    def get_net_degree(args) -> int:
+        """ The mean number of ties of an agent, set by net_media. """
+        if args.net_media == "low":
+            degree = 1
+        elif args.net_media == "high":
+            degree = 4
+        return degree
+
+
+    @staticmethod
+    def load_net_file(args) -> CSRNetwork:
+        """
+        The network of args.net_file (see network.open_edge_list; a .npz is
+        loaded as a CSRNetwork.save file). The parsed network is saved as
+        <file>.<sha256 of the file>.csr.npz in args.net_cache (or next to the
+        file) and reloaded from there, so that only the same content reuses it.
+        """
+        path = args.net_file
+        if path.endswith(".npz"):
+            return CSRNetwork.load(path)
+        csr_path = os.path.join(os.path.dirname(path) if args.net_cache is None else args.net_cache,
+            "{}.{}.csr.npz".format(os.path.basename(path), file_digest(path)[:16]))
+        if os.path.exists(csr_path):
+            return CSRNetwork.load(csr_path)
+
+        net = CSRNetwork.from_edge_file(path)
+        os.makedirs(os.path.dirname(os.path.abspath(csr_path)), exist_ok=True)
+        tmp_path = "{}.{}.tmp.npz".format(csr_path[:-4], os.getpid())
+        net.save(tmp_path)
+        os.replace(tmp_path, csr_path)
+        return net
+
+
+    def use_net_file(self, args):
+        """ Load args.net_file (if given) as self.file_net; return a copy of args with N set to its number of nodes. """
+        self.file_net = None
+        if args.net_file is None:
+            return args
+        self.file_net = self.load_net_file(args)
+        args = copy.copy(args)
+        args.N = self.file_net.n_nodes
+        return args
+
+
+    def build_net(self, n_blocks=1) -> CSRNetwork:
+        """
+        Build the network of args.net_type (n_blocks disconnected blocks):
+        1. random: N*degree random ties, drawn from self.rng
+        2. fixed_degree: every agent has exactly degree ties
+        3. small_world: Watts-Strogatz, rewiring probability args.ws_p
+        4. scale_free: Barabasi-Albert
+        The types 2-4 are drawn from their own seed (derived from args.net_seed,
+        or from the run seed) and cached in args.net_cache if given, keyed by
+        (type, N, degree, seed), so that the runs sharing a network build it once.
+        With args.net_file, every block is a copy of the network of the file instead.
+        """
+        args = self.args
+        if args.net_file is not None:
+            return self.file_net.tile(n_blocks)
+        degree = self.get_net_degree(args)
+        if args.net_type == "random":
+            return CSRNetwork.random_ties(args.N, degree*args.N, self.rng, n_blocks=n_blocks)
+
+        net_seed = derive_seed(self.rnd_seed if args.net_seed is None else args.net_seed, "net")
+        path = None
+        if args.net_cache is not None:
+            seed_hash = hashlib.sha256(json.dumps(seed_to_json(net_seed)).encode()).hexdigest()[:16]
+            params = "_p_{}".format(args.ws_p) if args.net_type == "small_world" else ""
+            path = os.path.join(args.net_cache, "{}_N_{}_deg_{}{}_blocks_{}_seed_{}.npz".format(
+                args.net_type, args.N, degree, params, n_blocks, seed_hash))
+            if os.path.exists(path):
+                return CSRNetwork.load(path)
+
+        rng = np.random.default_rng(net_seed)
+        if args.net_type == "fixed_degree":
+            net = CSRNetwork.fixed_degree(args.N, degree, rng, n_blocks=n_blocks)
+        elif args.net_type == "small_world":
+            net = CSRNetwork.small_world(args.N, degree, args.ws_p, rng, n_blocks=n_blocks)
+        elif args.net_type == "scale_free":
+            net = CSRNetwork.scale_free(args.N, degree, rng, n_blocks=n_blocks)
+        else:
+            raise ValueError("unknown net_type: {}.".format(args.net_type))
+
+        if path is not None:
+            os.makedirs(args.net_cache, exist_ok=True)
+            tmp_path = "{}.{}.tmp.npz".format(path[:-4], os.getpid())
+            net.save(tmp_path)
+            os.replace(tmp_path, path)
+        return net
 
 
     def init_ags(self) -> list:
         # init agents
-        ags = [Agent(self.args) for _ in range(self.args.N)]
+        ags = [Agent(self.args, self.rnd, self.counter) for _ in range(self.args.N)]
 
         # set extremists
         if self.args.ratio_ex != 0.0:
@@ -238,27 +405,60 @@ class InnovationDiffusion(object):
                 sorted_ag[i].update(timestep=0)
 
         # build net
-        # method 1: randomly build ties
-        if self.args.net_media == "low":
-            n_edges = 1 * self.args.N
-        elif self.args.net_media == "high":
-            n_edges = 4 * self.args.N
-        
-        pool = np.arange(self.args.N)
-        for _ in range(n_edges):
-            ag_u_idx, ag_v_idx = np.random.choice(pool, replace=False, size=2)
-            ags[ag_u_idx].net.append(ags[ag_v_idx])
-
-        # method 2: every individual has exactly the same # of ties
-        # for ag_idx in range(len(ags)):
-        #     if self.args.net_media == "low":
-        #         n_edges = 1
-        #     elif self.args.net_media == "high":
-        #         n_edges = 4
-        #     for ag_v_idx in self.get_randint(0, len(ags), exclude=ag_idx, size=n_edges):
-        #         ags[ag_idx].net.append(ags[ag_v_idx])
+        self.net = self.build_net()
+        for ag_idx, ag in enumerate(ags):
+            ag.net = self.net.neighbors(ag_idx)
+            ag.ags = ags
         
         return ags
+
+
+    def _get_engine_state(self) -> dict:
+        """ The state of the agents as arrays (None is saved as nan or -1), their queues and the RandomPool. """
+        ags = self.ags
+        state = {name: np.array([getattr(ag, name) for ag in ags], dtype=float) for name in
+                 ("soc_op", "soc_U", "soc_op_delta", "soc_U_delta", "glo_op", "glo_U")}
+        for name in ("ind_benefit", "ind_U"):
+            state[name] = np.array([np.nan if getattr(ag, name) is None else getattr(ag, name) for ag in ags])
+        for name in ("interest", "yes_rd"):
+            state[name] = np.array([-1 if getattr(ag, name) is None else getattr(ag, name) for ag in ags], dtype=np.int64)
+        state["decision"] = np.array([ag.decision for ag in ags], dtype=np.int64)
+        for name in ("info", "is_extrem", "get_info_discussion"):
+            state[name] = np.array([getattr(ag, name) for ag in ags], dtype=bool)
+
+        state.update(prefixed("queue", pack_queues([ag.t0_rd_queue for ag in ags])))
+        state.update(prefixed("queue_new", pack_queues([ag.t0_rd_queue_new for ag in ags])))
+        state.update(prefixed("pool", self.rnd.get_state()))
+        return state
+
+
+    def _set_engine_state(self, state: dict) -> None:
+        """ Rebuild the RandomPool, the counter and the agents (on self.net) from _get_engine_state. """
+        self.rnd = RandomPool(self.rng)
+        self.rnd.set_state(unprefixed("pool", state))
+        self.counter = PopulationCounter(self.args.N, self.args.n_steps, Agent.DECISIONS, Agent.INTERESTS)
+
+        N = self.args.N
+        values = {name: value.tolist() for name, value in state.items() if "." not in name}
+        queues = unpack_queues(unprefixed("queue", state), N)
+        queues_new = unpack_queues(unprefixed("queue_new", state), N)
+        self.ags = list()
+        for ag_idx in range(N):
+            ag = Agent.__new__(Agent)
+            ag.id, ag.args, ag.rnd, ag.counter = ag_idx, self.args, self.rnd, self.counter
+            ag.net, ag.ags = self.net.neighbors(ag_idx), self.ags
+            ag.t0_rd_queue, ag.t0_rd_queue_new = queues[ag_idx], queues_new[ag_idx]
+            for name in ("soc_op", "soc_U", "soc_op_delta", "soc_U_delta", "glo_op", "glo_U", "decision",
+                         "info", "is_extrem", "get_info_discussion"):
+                setattr(ag, name, values[name][ag_idx])
+            for name in ("ind_benefit", "ind_U"):
+                value = values[name][ag_idx]
+                setattr(ag, name, None if np.isnan(value) else value)
+            for name in ("interest", "yes_rd"):
+                value = values[name][ag_idx]
+                setattr(ag, name, None if value == -1 else value)
+            self.ags.append(ag)
+        Agent._ids = itertools.count(N)
     
 
     def get_result(self):
@@ -269,19 +469,55 @@ class InnovationDiffusion(object):
         2. the ratio of adopters
         """
 
-        informed = sum([1 for ag in self.ags if ag.info])/self.args.N
-        adopters = sum([1 for ag in self.ags if ag.decision == Agent.ADOPTION])/self.args.N
-        not_concern = sum([1 for ag in self.ags if ag.decision == Agent.NOT_CONCERNED])/self.args.N
+        informed = self.counter.informed/self.args.N
+        adopters = self.counter.decision[Agent.ADOPTION]/self.args.N
+        not_concern = self.counter.decision[Agent.NOT_CONCERNED]/self.args.N
         return informed, adopters, not_concern
+
+
+    def get_count_series(self) -> np.ndarray:
+        """
+        Return the per-step population counts, shaped (n_steps+1, len(self.counter.columns)):
+        informed, then the number of agents in each decision and interest state.
+        """
+        return self.counter.get_series()
     
 
-    def update_soc_op_dis(self):
-        dis = np.array([[ag.soc_op for ag in self.ags]])
-        self.soc_op_dis = np.concatenate((self.soc_op_dis, dis), axis=0)
+    def update_soc_op_dis(self, timestep):
+        if self.stats is not None and self.stats.wants(timestep):
+            self.stats.record(timestep, np.fromiter((ag.soc_op for ag in self.ags), dtype=float, count=len(self.ags)))
+        if not self.recorder.wants(timestep):
+            return
+        ags = self.ags if self.recorder.agent_idx is None else [self.ags[i] for i in self.recorder.agent_idx]
+        kwargs = dict()
+        if "decision" in self.recorder.fields:
+            kwargs["decision"] = np.fromiter((ag.decision for ag in ags), dtype=np.int8, count=len(ags))
+        if "info" in self.recorder.fields:
+            kwargs["info"] = np.fromiter((ag.info for ag in ags), dtype=bool, count=len(ags))
+        self.recorder.record(timestep, np.fromiter((ag.soc_op for ag in ags), dtype=float, count=len(ags)), **kwargs)
     
 
     def get_soc_op_dis(self):
-        return self.soc_op_dis
+        """ Return the recorded opinions, shaped (n_recorded_steps, n_recorded_agents). """
+        return self.recorder.get()
+
+
+    def get_is_extrem(self) -> np.ndarray:
+        return np.array([ag.is_extrem for ag in self.ags])
+
+
+    def get_soc_op(self) -> np.ndarray:
+        return np.fromiter((ag.soc_op for ag in self.ags), dtype=float, count=len(self.ags))
+
+
+    def has_pending_transitions(self) -> bool:
+        """
+        Whether some agent has pending queue entries or can get informed by the media
+        (or, in the synchronous mode, is in PRE_ADOPTION and may adopt).
+        """
+        sync = self.args.update_mode == "sync"
+        return any(ag.t0_rd_queue or (not ag.info and ag.decision == Agent.INFO_REQUEST)
+                   or (sync and ag.decision == Agent.PRE_ADOPTION) for ag in self.ags)
 
 
     def simulate_step(self, timestep):
@@ -289,45 +525,717 @@ class InnovationDiffusion(object):
         Each timestep:
         1. each agent received information from the media a probability
         2. each agent initiates disccusion with its neighbors
-        3. each agent update status
+        3. each agent update status (synchronous mode only)
+        The phases are timed if self.profiler is set.
         """
-        # 1.
-        for ag in self.ags:
-            ag.receive_info_media(timestep)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start(timestep)
+
+        # 1. (only the agents hit by the media have something to do)
+        u = self.rng.random(len(self.ags))
+        hit_idx = np.flatnonzero(u < Agent.get_media_p(self.args))
+        for ag_idx, u_i in zip(hit_idx.tolist(), u[hit_idx].tolist()):
+            self.ags[ag_idx].receive_info_media(timestep, u_i)
+        self.active.add(hit_idx)
+        if profiler is not None:
+            profiler.lap("media")
+            queue_len = [sum(self.ags[ag_idx].t0_rd_queue.values()) for ag_idx in np.flatnonzero(self.active.is_active)]
+            profiler.set_queues(sum(queue_len), max(queue_len, default=0))
         
-        # synchronous
-        # # 2.
-        # for ag in self.ags:
-        #     ag.discuss(timestep)
-
-        # # 3.
-        # for ag in self.ags:
-        #     ag.update(timestep)
-
-        # asynchronous
-        ags_copy = self.ags.copy()
-        np.random.shuffle(ags_copy)
-        for ag in ags_copy:
-            ag.discuss(timestep)
+        # 2. (only the agents with pending queue entries, shuffled)
+        for ag_idx in self.active.pop_shuffled(self.rng):
+            self.ags[ag_idx].discuss(timestep, profiler)
+        if profiler is not None:
+            profiler.lap("discuss")
+
+        # 3.
+        if self.args.update_mode == "sync":
+            for ag in self.ags:
+                ag.update(timestep)
+            self.active.add([ag_idx for ag_idx, ag in enumerate(self.ags) if ag.t0_rd_queue])
+            if profiler is not None:
+                profiler.lap("update")
         
-        self.update_soc_op_dis()
+        self.update_soc_op_dis(timestep)
+        self.counter.record(timestep)
+        self.timestep = timestep
+        if profiler is not None:
+            profiler.lap("record")
     
 
+    def print_result(self, timestep):
+        informed, adopters, not_conern = self.get_result()
+        print("| iter {} | informed: {:.2f}%; adopters: {:.2f}%; not_concern: {:.2f}%".format(("  "+str(timestep))[-3:],
+            informed*100, adopters*100, not_conern*100))
+
+
+    def fill_to_end(self, timestep):
+        """ After an early stop at timestep, repeat the final state in the remaining records. """
+        self.recorder.fill_to_end()
+        self.counter.fill_to_end()
+        if self.stats is not None:
+            self.stats.fill_to_end()
+
+
     def simulate(self, log_v=50):
+        """
+        Run the steps after self.timestep up to args.n_steps, or stop early if
+        args.early_stop is set and the ConvergenceMonitor criterion holds
+        (self.stop_step is then the last step). With args.checkpoint_out, the
+        run is checkpointed every args.checkpoint_every steps and at the end.
+        """
+        for _ in self.simulate_iter(log_v=log_v):
+            pass
+
+
+    def simulate_iter(self, log_v=50, with_soc_op=False):
+        """
+        Generator version of simulate: yield a StepSnapshot after each step.
+        With with_soc_op, snapshot.soc_op is a read-only view of the current
+        opinions, only valid until the next step (the vector engines do not
+        copy; the object engine has to gather them from the agents).
+
+        The caller may stop iterating at any step: the run then stays at
+        that step (simulate or simulate_iter continue it). The outputs of the
+        end of the run (final checkpoint, profile, stats) are only written
+        if the iteration completes. A run that already stopped early (e.g.
+        restored from its final checkpoint) yields nothing.
+        """
+        monitor = self.monitor
+        if self.stop_step is not None:
+            if self.verbose:
+                print("the run already stopped at iter {}".format(self.stop_step))
+            return
         if self.verbose:
-            informed, adopters, not_conern = self.get_result()
-            print("| iter {} | informed: {:.2f}%; adopters: {:.2f}%; not_concern: {:.2f}%".format("  0", 
-                informed*100,adopters*100, not_conern*100))
+            self.print_result(self.timestep)
+
+        try:
+            for timestep in range(self.timestep+1, self.args.n_steps+1):
+                self.simulate_step(timestep)
+                if self.verbose and timestep % log_v == 0:
+                    self.print_result(timestep)
+                if monitor is not None and monitor.update(timestep, self):
+                    self.stop_step = timestep
+                    self.fill_to_end(timestep)
+                    if self.verbose:
+                        print("converged ({}), stop at iter {}".format(monitor.mode, timestep))
+                    yield self.get_snapshot(with_soc_op)
+                    break
+                if self.args.checkpoint_out is not None and self.args.checkpoint_every > 0 \
+                    and timestep % self.args.checkpoint_every == 0:
+                    self.checkpoint(self.args.checkpoint_out)
+                yield self.get_snapshot(with_soc_op)
+        finally:
+            self.recorder.flush()
+
+        if self.args.checkpoint_out is not None:
+            self.checkpoint(self.args.checkpoint_out)
+        if self.profiler is not None and self.args.profile_out is not None:
+            self.profiler.save(self.args.profile_out)
+        if self.stats is not None and self.args.stats_out is not None:
+            self.stats.save(self.args.stats_out)
+
+
+    def get_snapshot(self, with_soc_op=False) -> StepSnapshot:
+        """ The StepSnapshot of the current step (see simulate_iter). """
+        soc_op = None
+        if with_soc_op:
+            soc_op = self.get_soc_op().view()
+            soc_op.flags.writeable = False
+        return StepSnapshot(self.timestep, self.counter.get_counts(), self.get_result(), soc_op)
+
+
+    def get_state(self, with_traj=None) -> dict:
+        """
+        The complete state of the run as a dict of arrays: the agents and
+        their discussion queues, the network, the counts, the trajectory
+        and the random state. with_traj: whether the recorded trajectory rows
+        are included (by default unless they are streamed to disk).
+        """
+        state = {"timestep": np.array(self.timestep), "rng": get_rng_state(self.rng),
+                 "stop_step": np.array(-1 if self.stop_step is None else self.stop_step),
+                 "net.indptr": self.net.indptr, "net.indices": self.net.indices}
+        state.update(prefixed("engine", self._get_engine_state()))
+        state.update(prefixed("counter", self.counter.get_state()))
+        state.update(prefixed("active", self.active.get_state()))
+        if with_traj is None:
+            state.update(prefixed("traj", self.recorder.get_state()))
+        else:
+            state.update(prefixed("traj", self.recorder.get_state(with_traj)))
+        if self.monitor is not None:
+            state.update(prefixed("monitor", self.monitor.get_state()))
+        if self.stats is not None:
+            state.update(prefixed("stats", self.stats.get_state()))
+        return state
+
+
+    def _restore(self, args, state: dict, verbose=True, traj_mode="w+") -> None:
+        """
+        Rebuild the run of args from get_state, in place of __init__ (see
+        resume and fork). traj_mode is the mode of the trajectory files, if streamed.
+        """
+        self.verbose = verbose
+        self.args = args
+        if self.verbose:
+            print("Args: {}".format(args))
+
+        self.rnd_seed = args.rnd_seed
+        self.rng = np.random.default_rng()
+        set_rng_state(self.rng, state["rng"])
+        self.timestep, self.stop_step = int(state["timestep"]), None
+        if int(state.get("stop_step", -1)) >= 0:
+            self.stop_step = int(state["stop_step"])
+        if self.timestep > args.n_steps:
+            raise ValueError("n_steps should be >= the timestep of the state ({}).".format(self.timestep))
+
+        self.net = CSRNetwork(state["net.indptr"], state["net.indices"])
+        self._set_engine_state(unprefixed("engine", state))
+        self.counter.set_state(unprefixed("counter", state))
+        self.active = ActiveSet(self.counter.n_agents)
+        self.active.set_state(unprefixed("active", state))
+        self.profiler = StepProfiler.from_args(args)
+        self.monitor = ConvergenceMonitor.from_args(args)
+        if self.monitor is not None:
+            self.monitor.set_state(unprefixed("monitor", state))
+
+        self.recorder = TrajectoryRecorder.from_args(args, mode=traj_mode)
+        self.recorder.set_is_extrem(np.ravel(self.get_is_extrem())[:args.N])
+        self.recorder.set_state(unprefixed("traj", state))
+        self.recorder.flush()
+        self.stats = OpinionStatsRecorder.from_args(args)
+        if self.stats is not None:
+            self.stats.set_is_extrem(np.ravel(self.get_is_extrem())[:args.N])
+            if "stats.n_recorded" in state:
+                self.stats.set_state(unprefixed("stats", state))
+
+
+    def checkpoint(self, path: str) -> None:
+        """ Save the complete state of the run to path (.npz); InnovationDiffusion.resume(path) continues it. """
+        self.recorder.flush()
+        save_checkpoint(path, type(self).__name__, self.args, self.get_state())
+
+
+    @staticmethod
+    def resume(path: str, verbose=True) -> "InnovationDiffusion":
+        """
+        Rebuild the run saved by checkpoint(path). simulate() then continues
+        it from its timestep, bit-identically to the uninterrupted run.
+        """
+        models = {cls.__name__: cls for cls in (InnovationDiffusion, VecInnovationDiffusion, BatchInnovationDiffusion)}
+        model_name, args, state = load_checkpoint(path)
+        model = object.__new__(models[model_name])
+        model._restore(args, state, verbose=verbose, traj_mode="r+")
+        return model
+
+
+    # the args a fork cannot change (they fix the shape of the state)
+    FORK_FIXED = ("N", "engine", "traj_stride", "traj_n_agents")
+
+    def fork(self, overrides=None, verbose=False) -> "InnovationDiffusion":
+        """
+        Copy the run at its current timestep, with the args updated by
+        overrides (e.g. {"mu": 0.5} to test an intervention from now on).
+        The copy starts from the same random state, so without overrides both
+        continue bit-identically; "rnd_seed" in overrides reseeds the copy.
+        The copy of a run that stopped early is stopped too.
+        """
+        overrides = dict() if overrides is None else dict(overrides)
+        unknown = [name for name in overrides if not hasattr(self.args, name)]
+        if unknown:
+            raise ValueError("unknown arguments: {}.".format(", ".join(unknown)))
+        fixed = [name for name in self.FORK_FIXED if name in overrides and overrides[name] != getattr(self.args, name)]
+        if fixed:
+            raise ValueError("{} cannot be changed by a fork.".format(", ".join(fixed)))
+
+        args = copy.copy(self.args)
+        for name, value in overrides.items():
+            setattr(args, name, value)
+        if args.traj_out is not None and args.traj_out == self.args.traj_out:
+            raise ValueError("the fork needs its own traj_out.")
+
+        state = self.get_state(with_traj=True)
+        if "rnd_seed" in overrides:
+            state["rng"] = get_rng_state(np.random.default_rng(overrides["rnd_seed"]))
+            for name in ("engine.pool.uniform", "engine.pool.normal"):
+                if name in state:
+                    state[name] = np.zeros(0)
+        model = object.__new__(type(self))
+        model._restore(args, state, verbose=verbose)
+        return model
+
+
+class VecInnovationDiffusion(InnovationDiffusion):
+    """
+    Struct-of-arrays engine. The per-agent state of `Agent` is kept in NumPy
+    arrays (indexed by agent id), so that the media step and the
+    interest/decision state machine run as batched array operations.
+    The asynchronous discussion pass is still sequential over the speakers.
+
+    The discussion queues are counts indexed by age (timestep - t0_rd):
+    queue[i, a] is the number of pending entries of agent i of age a.
+
+    The arrays hold n_reps independent populations of args.N agents
+    (replicate-major, see BatchInnovationDiffusion); n_reps is 1 here.
+    """
+
+    def __init__(self, args: argparse.ArgumentParser, rnd_seed: int, verbose=True, n_reps=1) -> None:
+        self.rnd_seed = rnd_seed
+        self.rng = np.random.default_rng(rnd_seed)
+
+        self.verbose = verbose
+        self.args = args = self.use_net_file(args)
+        self.n_reps = n_reps
+        if self.verbose:
+            print("Args: {}".format(args))
+
+        self.counter = PopulationCounter(n_reps*args.N, args.n_steps, Agent.DECISIONS, Agent.INTERESTS, init_interest=0)
+        self.init_ags()
+        self.active = ActiveSet(self.info.size)
+        self.counter.record(0)
+        self.profiler = StepProfiler.from_args(args)
+        self.monitor = ConvergenceMonitor.from_args(args)
+        self.timestep, self.stop_step = 0, None
+
+        # social opinions distribution (of the first replicate)
+        self.recorder = TrajectoryRecorder.from_args(args)
+        self.recorder.set_is_extrem(self.is_extrem[:args.N])
+        self.stats = OpinionStatsRecorder.from_args(args)
+        if self.stats is not None:
+            self.stats.set_is_extrem(self.is_extrem[:args.N])
+        self.update_soc_op_dis(timestep=0)
+
+
+    def init_ags(self) -> None:
+        N = self.n_reps * self.args.N
+
+        # social opinion
+        self.soc_op = self.rng.normal(loc=self.args.m_s, scale=self.args.sd_s, size=N)
+        self.soc_U = np.full(N, self.args.U_s, dtype=float)
+
+        # individual opinion (nan stands for None)
+        self.ind_benefit = np.full(N, np.nan)
+        self.ind_U = np.full(N, np.nan)
+
+        # information, interest, decision
+        self.info = np.zeros(N, dtype=bool)
+        self.interest = np.zeros(N, dtype=np.int8)
+        self.decision = np.full(N, -1, dtype=np.int8)
+
+        # the first round that the agent started in the PRE_ADOPTION status (-1 stands for None)
+        self.yes_rd = np.full(N, -1, dtype=np.int64)
+
+        self.is_extrem = np.zeros(N, dtype=bool)
+        self._update_status(np.arange(N), timestep=0)
+
+        # discussion-to-propagate queue
+        self.n_ages = self.get_n_ages(self.args.gamma, self.args.n_steps)
+        self.queue = np.zeros((N, self.n_ages), dtype=np.int32)
+
+        # set extremists (the n_ex highest opinions of each replicate)
+        if self.args.ratio_ex != 0.0:
+            n_ex = round(self.args.N * self.args.ratio_ex)
+            ex_idx = np.argsort(-self.soc_op.reshape(self.n_reps, -1), axis=1, kind="stable")[:, :n_ex]
+            ex_idx = (ex_idx + self.args.N * np.arange(self.n_reps)[:, np.newaxis]).ravel()
+            self.is_extrem[ex_idx] = True
+            self.soc_U[ex_idx] = self.args.U_s_ex
+            self._update_status(ex_idx, timestep=0)
+
+        # build net (one disconnected block per replicate)
+        self.net = self.build_net(n_blocks=self.n_reps)
+
+
+    # the per-agent arrays of the state
+    FIELDS = ("soc_op", "soc_U", "ind_benefit", "ind_U", "info", "interest", "decision", "yes_rd", "is_extrem")
+
+    def _get_engine_state(self) -> dict:
+        state = {name: getattr(self, name) for name in self.FIELDS}
+        state.update({"queue": self.queue, "n_reps": np.array(self.n_reps)})
+        return state
+
+
+    def _set_engine_state(self, state: dict) -> None:
+        """
+        Restore _get_engine_state. If args.gamma or args.n_steps changed (see
+        fork), the queue ages that are now expired are dropped.
+        """
+        self.n_reps = int(state["n_reps"])
+        for name in self.FIELDS:
+            setattr(self, name, state[name].copy())
+        self.counter = PopulationCounter(self.info.size, self.args.n_steps, Agent.DECISIONS, Agent.INTERESTS, init_interest=0)
+
+        self.n_ages = self.get_n_ages(self.args.gamma, self.args.n_steps)
+        self.queue = np.zeros((self.info.size, self.n_ages), dtype=np.int32)
+        n_ages = min(self.n_ages, state["queue"].shape[1])
+        self.queue[:, :n_ages] = state["queue"][:, :n_ages]
+
+
+    @staticmethod
+    def get_n_ages(gamma, n_steps) -> int:
+        """ The number of ages a with 1-gamma*a > 0, i.e. the ages of the entries that are not expired. """
+        n_ages = 1
+        while n_ages <= n_steps and 1-gamma*n_ages > 0:
+            n_ages += 1
+        return n_ages
+
+
+    def _update_status(self, idx: np.ndarray, timestep) -> None:
+        """
+        Batched version of `Agent._update_status` for the agents in idx.
+        1. update global opinion
+        2. update interest
+        3. update decision
+        """
+        idx = idx[self.decision[idx] != Agent.ADOPTION]
+        if idx.size == 0:
+            return
+        info = self.info[idx]
+        old_decision, old_interest = self.decision[idx], self.interest[idx]
+
+        # 1.
+        glo_op = np.where(info, (self.soc_op[idx] + self.ind_benefit[idx]) / 2, self.soc_op[idx])
+        glo_U = np.where(info, (self.soc_U[idx] + self.ind_U[idx]) / 2, self.soc_U[idx])
+
+        # 2.
+        interest = np.full(idx.size, Agent.MAYBE, dtype=np.int8)
+        interest[glo_op-glo_U > 0] = Agent.YES
+        interest[glo_op+glo_U < 0] = Agent.NO
+        is_yes = interest == Agent.YES
+        self.interest[idx] = interest
+
+        yes_rd = np.where(is_yes, self.yes_rd[idx], -1)
+
+        # 3.
+        decision = np.where(is_yes | (interest == Agent.MAYBE), Agent.INFO_REQUEST, Agent.NOT_CONCERNED)
+        decision[info & ~is_yes] = Agent.NO_ADOPTION
+        info_yes = info & is_yes
+        adopt = info_yes & (yes_rd >= 0) & (timestep - yes_rd >= self.args.rho)
+        decision[adopt] = Agent.ADOPTION
+        decision[info_yes & ~adopt] = Agent.PRE_ADOPTION
+        yes_rd[info_yes & (yes_rd < 0)] = timestep
+
+        self.decision[idx] = decision
+        self.yes_rd[idx] = yes_rd
+        self.counter.move_many(old_decision, decision, old_interest, interest)
+
+
+    def _get_info_and_evaluate_benefit(self, idx: np.ndarray) -> None:
+        """ idx holds distinct ids. """
+        self.counter.add_informed(int(np.count_nonzero(~self.info[idx])))
+        self.info[idx] = True
+        self.ind_benefit[idx] = self.rng.normal(loc=self.args.m_i, scale=self.args.sd_i, size=np.shape(idx))
+        self.ind_U[idx] = self.args.U_i
+
+
+    def receive_info_media(self, timestep) -> None:
+        hit = self.rng.random(self.info.size) < Agent.get_media_p(self.args)
+        recv_idx = np.flatnonzero(hit & ~self.info & (self.decision == Agent.INFO_REQUEST))
+        self._get_info_and_evaluate_benefit(recv_idx)
+        self._update_status(recv_idx, timestep)
+
+        self.queue[hit, 0] += 1
+        self.active.add(np.flatnonzero(hit))
+
+
+    def _draw_contacts(self, speakers: np.ndarray):
+        """
+        Pop the queues of the speakers and draw the contacts of all their entries in one batch.
+        The duplicates of an age are discussed with a combined sample.
+        Return the (src, dst, age) arrays, grouped by speaker in the given order.
+        """
+        proportion = np.maximum(1-self.args.gamma*np.arange(self.n_ages), 0)
+        n_to_discuss = np.rint(self.net.degree()[speakers, np.newaxis] * proportion).astype(np.int64)
+        sizes = (self.queue[speakers] * n_to_discuss).ravel()
+        self.queue[speakers] = 0
+
+        src, dst = self.net.sample_contacts(np.repeat(speakers, self.n_ages), sizes, self.rng)
+        age = np.repeat(np.tile(np.arange(self.n_ages), speakers.size), sizes)
+        return src, dst, age
+
+
+    def discuss(self, src: np.ndarray, dst: np.ndarray, timestep, profiler: StepProfiler=None):
+        """
+        Process the discussions src[k] -> dst[k] in order (asynchronous:
+        every change is visible to the later discussions). The pass runs in
+        the compiled kernels.get_discuss_pass() if numba is installed (and args.jit),
+        else on Python lists. The new benefits are drawn in one batch at the end.
+        """
+        mu, omega = self.args.mu, self.args.omega
+        discuss_pass = kernels.get_discuss_pass() if self.args.jit else None
+        if discuss_pass is not None:
+            new_info, n_infl = discuss_pass(src, dst, self.rng.random(src.size) < omega,
+                self.soc_op, self.soc_U, self.info.copy(), self.decision == Agent.INFO_REQUEST, mu)
+            self._get_info_and_evaluate_benefit(new_info)
+            if profiler is not None:
+                profiler.add(contacts=src.size, influence=n_infl, omega=new_info.size)
+            return
+
+        soc_op, soc_U = self.soc_op.tolist(), self.soc_U.tolist()
+        info = self.info.tolist()
+        info_request = (self.decision == Agent.INFO_REQUEST).tolist()
+        omega_draws = (self.rng.random(src.size) < omega).tolist()
+        new_info = list()
+        n_infl = 0
+
+        for i, j, draw in zip(src.tolist(), dst.tolist(), omega_draws):
+            # social influence
+            op_i, U_i, op_j, U_j = soc_op[i], soc_U[i], soc_op[j], soc_U[j]
+            h_ij = min(op_i+U_i, op_j+U_j) - max(op_i-U_i, op_j-U_j)
+            if h_ij > U_i:
+                soc_op[j] = op_j + mu * (h_ij/U_i - 1) * (op_i - op_j)
+                soc_U[j] = U_j + mu * (h_ij/U_i - 1) * (U_i - U_j)
+                n_infl += 1
+
+            # receive information from other agent
+            if info[i] and (not info[j] and info_request[j]):
+                if draw:
+                    info[j] = True
+                    new_info.append(j)
+
+        self.soc_op[:] = soc_op
+        self.soc_U[:] = soc_U
+        self._get_info_and_evaluate_benefit(np.array(new_info, dtype=np.int64))
+        if profiler is not None:
+            profiler.add(contacts=src.size, influence=n_infl, omega=len(new_info))
+
+
+    def discuss_sync(self, src: np.ndarray, dst: np.ndarray, age: np.ndarray, timestep, profiler: StepProfiler=None):
+        """
+        Synchronous discussions src[k] -> dst[k]: every influence and
+        information transfer is computed from the state at the start of the
+        step, summed per listener (scatter-add) and applied at once (the
+        status update of every agent follows, see simulate_step). The contacts
+        push their entry, one step older, to the listener's queue unless it
+        would be expired.
+        """
+        N = self.info.size
+        mu, omega = self.args.mu, self.args.omega
+        op_i, U_i = self.soc_op[src], self.soc_U[src]
+        op_j, U_j = self.soc_op[dst], self.soc_U[dst]
+
+        # social influence
+        h_ij = np.minimum(op_i+U_i, op_j+U_j) - np.maximum(op_i-U_i, op_j-U_j)
+        infl = h_ij > U_i
+        w = mu * (h_ij[infl]/U_i[infl] - 1)
+        soc_op_delta = np.bincount(dst[infl], weights=w * (op_i[infl] - op_j[infl]), minlength=N)
+        soc_U_delta = np.bincount(dst[infl], weights=w * (U_i[infl] - U_j[infl]), minlength=N)
+
+        # receive information from other agent
+        can_get = self.info[src] & ~self.info[dst] & (self.decision[dst] == Agent.INFO_REQUEST)
+        transfer = can_get & (self.rng.random(src.size) < omega)
+        get_info = np.unique(dst[transfer])
+
+        # propagate (the queues of the speakers have been popped)
+        keep = age+1 < self.n_ages
+        self.queue += np.bincount(dst[keep]*self.n_ages + age[keep]+1,
+            minlength=self.queue.size).reshape(self.queue.shape).astype(self.queue.dtype)
+        self.active.add(dst[keep])
+
+        # update
+        self.soc_op += soc_op_delta
+        self.soc_U += soc_U_delta
+        self._get_info_and_evaluate_benefit(get_info)
+        if profiler is not None:
+            profiler.add(contacts=src.size, influence=int(np.count_nonzero(infl)),
+                omega=int(np.count_nonzero(transfer)))
+
+
+    def get_result(self):
+        informed = self.counter.informed/self.info.size
+        adopters = self.counter.decision[Agent.ADOPTION]/self.info.size
+        not_concern = self.counter.decision[Agent.NOT_CONCERNED]/self.info.size
+        return informed, adopters, not_concern
+
+
+    def update_soc_op_dis(self, timestep):
+        N = self.args.N
+        self.recorder.record(timestep, self.soc_op[:N], decision=self.decision[:N], info=self.info[:N])
+        if self.stats is not None:
+            self.stats.record(timestep, self.soc_op[:N])
+
+
+    def get_is_extrem(self) -> np.ndarray:
+        return self.is_extrem.copy()
 
-        for timestep in range(1, self.args.n_steps+1):
-            self.simulate_step(timestep)
-            if self.verbose and timestep % log_v == 0:
-                informed, adopters, not_conern = self.get_result()
-                print("| iter {} | informed: {:.2f}%; adopters: {:.2f}%; not_concern: {:.2f}%".format(("  "+str(timestep))[-3:],
-                    informed*100, adopters*100, not_conern*100))
 
+    def get_soc_op(self) -> np.ndarray:
+        return self.soc_op
 
 
+    def has_pending_transitions(self) -> bool:
+        pending = self.queue.any() or np.any(~self.info & (self.decision == Agent.INFO_REQUEST))
+        if self.args.update_mode == "sync":
+            pending = pending or np.any(self.decision == Agent.PRE_ADOPTION)
+        return bool(pending)
+
+
+    def simulate_step(self, timestep):
+        """
+        Each timestep:
+        1. each agent received information from the media a probability
+        2. each agent with pending queue entries (the active set) discusses
+           with its neighbors (shuffled, asynchronous)
+        3. each agent update status (synchronous mode only, see discuss_sync)
+
+        In the asynchronous model the entries pushed to the neighbors during
+        discussion (Agent.t0_rd_queue_new) are never discussed, so they are not kept here.
+        The phases are timed if self.profiler is set.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start(timestep)
+
+        # 1.
+        self.receive_info_media(timestep)
+        if profiler is not None:
+            profiler.lap("media")
+            queue_len = self.queue.sum(axis=1)
+            profiler.set_queues(int(queue_len.sum()), int(queue_len.max(initial=0)))
+
+        # 2.
+        src, dst, age = self._draw_contacts(self.active.pop_shuffled(self.rng))
+        if self.args.update_mode == "sync":
+            self.discuss_sync(src, dst, age, timestep, profiler)
+        else:
+            self.discuss(src, dst, timestep, profiler)
+        if profiler is not None:
+            profiler.lap("discuss")
+
+        # 3.
+        if self.args.update_mode == "sync":
+            self._update_status(np.arange(self.info.size), timestep)
+            if profiler is not None:
+                profiler.lap("update")
+
+        self.update_soc_op_dis(timestep)
+        self.counter.record(timestep)
+        self.timestep = timestep
+        if profiler is not None:
+            profiler.lap("record")
+
+
+class BatchInnovationDiffusion(VecInnovationDiffusion):
+    """
+    n_reps replicates of the same args simulated in the same array pass.
+    Agent r*N+i of the arrays is the agent i of the replicate r, and the
+    replicates have disconnected networks. The discussion pass interleaves
+    the replicates, which does not matter since they never interact.
+    The recorded trajectory is the one of the first replicate.
+    """
+
+    def __init__(self, args: argparse.ArgumentParser, rnd_seed: int, verbose=True, n_reps=None) -> None:
+        n_reps = args.n_runs if n_reps is None else n_reps
+        super().__init__(args, rnd_seed, verbose=verbose, n_reps=n_reps)
+
+        # informed, adopters and not_concern ratios of each replicate
+        self.curves = np.zeros((3, args.n_steps+1, n_reps))
+        self.curves[:, 0] = self.get_result()
+
+
+    def get_result(self):
+        """ Return the 3 ratios of get_result as (n_reps,) arrays. """
+        shape = (self.n_reps, self.args.N)
+        informed = self.info.reshape(shape).mean(axis=1)
+        adopters = (self.decision == Agent.ADOPTION).reshape(shape).mean(axis=1)
+        not_concern = (self.decision == Agent.NOT_CONCERNED).reshape(shape).mean(axis=1)
+        return informed, adopters, not_concern
+
+
+    def _get_engine_state(self) -> dict:
+        state = super()._get_engine_state()
+        state["curves"] = self.curves[:, :self.timestep+1]
+        return state
+
+
+    def _set_engine_state(self, state: dict) -> None:
+        super()._set_engine_state(state)
+        self.curves = np.zeros((3, self.args.n_steps+1, self.n_reps))
+        self.curves[:, :state["curves"].shape[1]] = state["curves"]
+
+
+    def get_curves(self):
+        """ Return the informed, adopters and not_concern curves, each shaped (n_steps+1, n_reps). """
+        return self.curves[0], self.curves[1], self.curves[2]
+
+
+    def get_is_extrem(self) -> np.ndarray:
+        return self.is_extrem.reshape(self.n_reps, self.args.N).copy()
+
+
+    def print_result(self, timestep):
+        informed, adopters, not_conern = self.get_result()
+        print("| iter {} | informed: {:.2f}%; adopters: {:.2f}%; not_concern: {:.2f}% (mean of {} runs)".format(
+            ("  "+str(timestep))[-3:], informed.mean()*100, adopters.mean()*100, not_conern.mean()*100, self.n_reps))
+
+
+    def simulate_step(self, timestep):
+        super().simulate_step(timestep)
+        self.curves[:, timestep] = self.get_result()
+
+
+    def fill_to_end(self, timestep):
+        super().fill_to_end(timestep)
+        self.curves[:, timestep+1:] = self.curves[:, timestep:timestep+1]
+
+
+def plot_soc_op(args, soc_op, steps, is_extrem, plot_mode="lines"):
+    """
+    lines: one line per agent, in a single LineCollection (red: extremists).
+    density: a time x opinion histogram heatmap (for very large N); soc_op
+    may then be a memory-mapped array (see load_trajectory), read by chunks.
+    """
+    if soc_op.shape[1] == 0:
+        raise ValueError("no agent trajectory was recorded (traj_n_agents 0): use plot_mode stats.")
+    # matplotlib is only needed here, not to simulate
+    from plot import PlotLinesHandler
+
+    soc_op_hd = PlotLinesHandler(xlabel="Time", ylabel="Opinion",
+                                 ylabel_show="Opinion", x_lim=args.n_steps)
+    if plot_mode == "density":
+        soc_op_hd.plot_density(soc_op, x=steps)
+    else:
+        colors = np.where(np.asarray(is_extrem, dtype=bool), "red", "green")
+        soc_op_hd.plot_lines(soc_op, x=steps, colors=colors, linewidth=0.3)
+    
+    # title_param = "_".join(["rndSeed_{}".format(args.rnd_seed)] + ["{}_{}".format(k, v) for k, v in dict_to_use.items()])
+    title_param = "_".join([ArgsConfig.get_args_title_first(args), ArgsConfig.get_args_title_second(args), "rndSeed_{}".format(args.rnd_seed)])    
+    soc_op_hd.save_fig(title_param=title_param)
+
+
+def plot_opinion_stats(args, stats:dict):
+    """
+    Render the OpinionStatsRecorder summaries (see OpinionStatsRecorder.get):
+    the histogram of all the agents as a heatmap, with the median and the
+    5%-95% quantile band of the moderates (green) and of the extremists (red).
+    """
+    from plot import PlotLinesHandler
+
+    stats_hd = PlotLinesHandler(xlabel="Time", ylabel="OpinionStats",
+                                ylabel_show="Opinion", x_lim=args.n_steps)
+    groups, levels = list(stats["groups"]), list(stats["quantile_levels"])
+    steps = stats["steps"]
+    stats_hd.plot_hist(stats["hist"][:, groups.index("all")], x=steps, edges=stats["edges"])
+    for group, color in (("moderates", "green"), ("extremists", "red")):
+        if not stats["count"][:, groups.index(group)].any():
+            continue
+        quantiles = stats["quantiles"][:, groups.index(group)]
+        stats_hd.plot_band(quantiles[:, levels.index(0.05)], quantiles[:, levels.index(0.95)], x=steps, color=color)
+        stats_hd.plot_line(quantiles[:, levels.index(0.5)], x=steps, color=color, linewidth=1.5)
+
+    title_param = "_".join([ArgsConfig.get_args_title_first(args), ArgsConfig.get_args_title_second(args), "rndSeed_{}".format(args.rnd_seed)])
+    stats_hd.save_fig(title_param=title_param)
+
+
+def plot_result(args, game):
+    """
+    Plot the opinions of a finished run: its summaries if args.plot_mode is
+    stats (or if no trajectory was recorded but the summaries were), else its trajectories.
+    """
+    if args.plot_mode == "stats" or (game.recorder.n_cols == 0 and game.stats is not None):
+        plot_opinion_stats(args, game.stats.get())
+    else:
+        plot_soc_op(args, game.get_soc_op_dis(), game.recorder.get_steps(), game.recorder.is_extrem, args.plot_mode)
+
 
 if __name__ == "__main__":
     parser = ArgsConfig()
@@ -337,19 +1245,43 @@ if __name__ == "__main__":
     shift_to_positive_extremism = 13
     central_extrem_convergence = 15
     
-    # args = parser.get_exp_args(first_stage_int=11, second_stage_int=0)
-    args = parser.get_args()
-
-    soc_op_hd = PlotLinesHandler(xlabel="Time", ylabel="Opinion",
-                                 ylabel_show="Opinion", x_lim=args.n_steps)
-    game = InnovationDiffusion(args, rnd_seed=args.rnd_seed)
-    game.simulate()
-
-    soc_op = game.get_soc_op_dis()
-    for ag_idx in range(soc_op.shape[1]):
-        ag_soc_op = soc_op[:, ag_idx]
-        soc_op_hd.plot_line(ag_soc_op, color="red" if game.ags[ag_idx].is_extrem else "green", linewidth=0.3)
-    
-    # title_param = "_".join(["rndSeed_{}".format(args.rnd_seed)] + ["{}_{}".format(k, v) for k, v in dict_to_use.items()])
-    title_param = "_".join([ArgsConfig.get_args_title_first(args), ArgsConfig.get_args_title_second(args), "rndSeed_{}".format(args.rnd_seed)])    
-    soc_op_hd.save_fig(title_param=title_param)
+    cli_args = parser.get_cli_args()
+    if cli_args.traj_in is not None:
+        # re-plot the trajectories streamed by a previous run
+        traj = load_trajectory(cli_args.traj_in)
+        args = argparse.Namespace(**traj["meta"]["args"])
+        plot_soc_op(args, traj["soc_op"], traj["steps"], traj["is_extrem"], cli_args.plot_mode)
+    else:
+        # args = parser.get_exp_args(first_stage_int=11, second_stage_int=0)
+        if cli_args.resume is not None:
+            # continue a checkpointed run
+            game = InnovationDiffusion.resume(cli_args.resume)
+            args = game.args
+            game.simulate()
+            plot_result(args, game)
+        else:
+            args = parser.get_args()
+            if args.traj_n_agents == 0 and args.plot_mode != "stats":
+                print("no agent trajectory is recorded (traj_n_agents 0): plot_mode stats is used instead.")
+                args.plot_mode = "stats"
+            # the summaries are not cached: only look for a trajectory
+            args.opinion_stats = args.opinion_stats or args.plot_mode == "stats"
+            store = ResultStore.from_args(args, MODEL_VERSION)
+            # a cached run only gives its result and trajectory, not the per-run outputs
+            outputs = [name for name in ("traj_out", "checkpoint_out", "profile_out", "stats_out")
+                       if getattr(args, name) is not None]
+            if store is not None and outputs:
+                print("{} asked: the run is simulated, not looked up in the cache.".format(", ".join(outputs)))
+            cached = None
+            if store is not None and args.plot_mode != "stats" and not outputs:
+                cached = store.get(args, args.rnd_seed, with_traj=True)
+            if cached is not None:
+                print("| cached | informed: {:.2f}%; adopters: {:.2f}%; not_concern: {:.2f}%".format(
+                    *[ratio*100 for ratio in cached["result"]]))
+                plot_soc_op(args, cached["soc_op"], cached["steps"], cached["is_extrem"], args.plot_mode)
+            else:
+                game = InnovationDiffusion(args, rnd_seed=args.rnd_seed)
+                game.simulate()
+                if store is not None:
+                    store.put(args, args.rnd_seed, game, with_traj=args.cache_traj)
+                plot_result(args, game)
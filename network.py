@@ -0,0 +1,310 @@
+import itertools
+import os
+import warnings
+import numpy as np
+
+# the edges per chunk of the edge list files
+EDGE_CHUNK = 1 << 22
+
+
+class CSRNetwork(object):
+    """
+    Directed network in compressed sparse row (CSR) form.
+    The out-neighbors (direction: i -> j) of node i are
+    indices[indptr[i]:indptr[i+1]].
+    """
+
+    def __init__(self, indptr, indices) -> None:
+        super().__init__()
+        self.indptr = np.ascontiguousarray(indptr, dtype=np.int32)
+        self.indices = np.ascontiguousarray(indices, dtype=np.int32)
+
+    @property
+    def n_nodes(self) -> int:
+        return self.indptr.shape[0] - 1
+
+    @property
+    def n_edges(self) -> int:
+        return self.indices.shape[0]
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbors(self, i) -> np.ndarray:
+        """ Return a view (no copy) on the out-neighbors of node i. """
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def sample_neighbors(self, i, size:int, rng: np.random.Generator) -> np.ndarray:
+        """ Sample size out-neighbors of node i uniformly, with replacement. """
+        lo, hi = self.indptr[i], self.indptr[i+1]
+        return self.indices[lo + rng.integers(hi-lo, size=size)]
+
+    def sample_contacts(self, nodes, sizes, rng: np.random.Generator):
+        """
+        Batched sample_neighbors: node nodes[k] samples sizes[k] out-neighbors.
+        Return the (src, dst) arrays of the contacts, grouped by node in the given order.
+        """
+        src = np.repeat(np.asarray(nodes, dtype=np.int32), sizes)
+        lo = self.indptr[src]
+        deg = self.indptr[src+1] - lo
+        dst = self.indices[lo + (rng.random(src.size) * deg).astype(np.int32)]
+        return src, dst
+
+    @classmethod
+    def from_edges(cls, src, dst, n_nodes:int) -> "CSRNetwork":
+        """
+        Build from the edge arrays src -> dst. The order of the edges of
+        a node is kept (stable sort on src).
+        """
+        src = np.asarray(src)
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(n_nodes+1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+        return cls(indptr, np.asarray(dst)[order])
+
+    @classmethod
+    def random_ties(cls, n_nodes:int, n_edges:int, rng: np.random.Generator, n_blocks=1) -> "CSRNetwork":
+        """
+        Randomly build n_edges directed ties in a single batched draw.
+        Each tie is an ordered pair (u, v) drawn uniformly among the pairs
+        with u != v (no self-loops), as np.random.choice(pool, replace=False, size=2) does.
+
+        With n_blocks > 1, build n_blocks independent such networks as the
+        disconnected blocks of one network of n_blocks*n_nodes nodes.
+        """
+        src = rng.integers(n_nodes, size=(n_blocks, n_edges))
+        dst = rng.integers(n_nodes-1, size=(n_blocks, n_edges))
+        dst += dst >= src
+        offset = n_nodes * np.arange(n_blocks)[:, np.newaxis]
+        return cls.from_edges((src+offset).ravel(), (dst+offset).ravel(), n_blocks*n_nodes)
+
+    @classmethod
+    def _from_blocks(cls, make_edges, n_nodes:int, n_blocks:int) -> "CSRNetwork":
+        """ n_blocks disconnected blocks, the edges of each drawn by make_edges() -> (src, dst). """
+        src, dst = list(), list()
+        for block in range(n_blocks):
+            block_src, block_dst = make_edges()
+            src.append(block_src + block*n_nodes)
+            dst.append(block_dst + block*n_nodes)
+        return cls.from_edges(np.concatenate(src), np.concatenate(dst), n_blocks*n_nodes)
+
+    @staticmethod
+    def _distinct_targets(src, dst, n_nodes:int, redraw, rng: np.random.Generator, undirected=False):
+        """
+        Redraw (with redraw(rng, n_edges)) the targets of the self-loops and
+        of the duplicated ties until there are none. Undirected: (u, v) and
+        (v, u) are the same tie.
+        """
+        while True:
+            lo, hi = (np.minimum(src, dst), np.maximum(src, dst)) if undirected else (src, dst)
+            _, first = np.unique(lo.astype(np.int64)*n_nodes + hi, return_index=True)
+            bad = np.ones(src.size, dtype=bool)
+            bad[first] = False
+            bad |= src == dst
+            if not bad.any():
+                return dst
+            dst[bad] = redraw(rng, np.count_nonzero(bad), src[bad])
+
+    @classmethod
+    def fixed_degree(cls, n_nodes:int, degree:int, rng: np.random.Generator, n_blocks=1) -> "CSRNetwork":
+        """
+        Every node has exactly degree distinct out-neighbors (not itself),
+        uniformly drawn: all the ties are drawn at once, then only the
+        self-loops and duplicates are redrawn.
+        """
+        degree = min(degree, n_nodes-1)
+        def make_edges():
+            src = np.repeat(np.arange(n_nodes), degree)
+            redraw = lambda rng, size, src: rng.integers(n_nodes, size=size)
+            dst = cls._distinct_targets(src, redraw(rng, src.size, src), n_nodes, redraw, rng)
+            return src, dst
+        return cls._from_blocks(make_edges, n_nodes, n_blocks)
+
+    @classmethod
+    def small_world(cls, n_nodes:int, degree:int, p:float, rng: np.random.Generator, n_blocks=1) -> "CSRNetwork":
+        """
+        Watts-Strogatz small-world network: a ring lattice where each node is
+        tied to its degree nearest neighbors (degree//2 on each side, degree
+        rounded up to even, at least 2), then the far end of each tie is
+        rewired with probability p to a uniform node (no self-loop or
+        duplicate). The ties are undirected: both directions are kept.
+        """
+        half = max(1, (degree+1) // 2)
+        half = min(half, (n_nodes-1) // 2)
+        def make_edges():
+            src = np.repeat(np.arange(n_nodes), half)
+            dst = (src + np.tile(np.arange(1, half+1), n_nodes)) % n_nodes
+            rewire = rng.random(src.size) < p
+            dst[rewire] = rng.integers(n_nodes, size=np.count_nonzero(rewire))
+            redraw = lambda rng, size, src: rng.integers(n_nodes, size=size)
+            dst = cls._distinct_targets(src, dst, n_nodes, redraw, rng, undirected=True)
+            return np.concatenate([src, dst]), np.concatenate([dst, src])
+        return cls._from_blocks(make_edges, n_nodes, n_blocks)
+
+    @classmethod
+    def scale_free(cls, n_nodes:int, degree:int, rng: np.random.Generator, n_blocks=1) -> "CSRNetwork":
+        """
+        Barabasi-Albert scale-free network: starting from a clique of m+1
+        nodes, each new node ties to m earlier nodes chosen with a probability
+        proportional to their degree, m = degree//2 (at least 1) so that the
+        mean degree is about degree. The ties are undirected: both directions are kept.
+
+        Vectorised Batagelj-Brandes: the ties are a list of endpoint slots;
+        the target of a new tie copies a uniform earlier slot, so the
+        references are resolved by pointer doubling instead of node by node.
+        The rare self-loops and duplicates are redrawn the same way among the earlier ties.
+        """
+        m = max(1, degree // 2)
+        m = min(m, n_nodes-1)
+        seed_src, seed_dst = np.triu_indices(m+1, k=1)
+        n_seed = seed_src.size
+        src = np.concatenate([seed_src, np.repeat(np.arange(m+1, n_nodes), m)])
+        n_ties = src.size
+
+        def draw_targets(rng, ties):
+            """ The targets of the ties (ids >= n_seed): copy a uniform slot among the 2*tie earlier ones. """
+            dst = np.full(n_ties, -1, dtype=np.int64)
+            dst[:n_seed] = seed_dst
+            slot = (rng.random(ties.size) * 2*ties).astype(np.int64)
+            # even slot 2*e: the source of the tie e; odd slot 2*e+1: the target of the tie e
+            ptr = np.zeros(n_ties, dtype=np.int64)
+            ptr[ties] = slot // 2
+            is_src = np.zeros(n_ties, dtype=bool)
+            is_src[ties] = slot % 2 == 0
+            dst[ties[is_src[ties]]] = src[ptr[ties[is_src[ties]]]]
+            todo = ties[~is_src[ties]]
+            todo = todo[dst[todo] < 0] if todo.size else todo
+            while todo.size:
+                target = dst[ptr[todo]]
+                done = target >= 0
+                dst[todo[done]] = target[done]
+                todo = todo[~done]
+                ptr[todo] = ptr[ptr[todo]]
+            return dst
+
+        def make_edges():
+            ties = np.arange(n_seed, n_ties)
+            dst = draw_targets(rng, ties)
+            # redraw the self-loops and duplicates as uniform earlier nodes
+            redraw = lambda rng, size, src: (rng.random(size) * src).astype(np.int64)
+            dst = cls._distinct_targets(src.copy(), dst, n_nodes, redraw, rng, undirected=True)
+            return np.concatenate([src, dst]), np.concatenate([dst, src])
+        return cls._from_blocks(make_edges, n_nodes, n_blocks)
+
+    @staticmethod
+    def _chunk_edges(chunk) -> tuple:
+        """ The (src, dst) int64 arrays of an (n, 2) edge chunk, without the self-loops. """
+        chunk = np.asarray(chunk, dtype=np.int64).reshape(-1, 2)
+        if chunk.size and (chunk.min() < 0 or chunk.max() >= np.iinfo(np.int32).max):
+            raise ValueError("the node ids should be in [0, 2**31-1).")
+        keep = chunk[:, 0] != chunk[:, 1]
+        return chunk[keep, 0], chunk[keep, 1]
+
+    @classmethod
+    def from_edge_chunks(cls, chunks, n_nodes=None) -> "CSRNetwork":
+        """
+        Build from a list of (n, 2) src -> dst edge chunks (e.g. views of a
+        memory-mapped file, see open_edge_list) in two passes, without holding
+        all the edges at once: count the out-degrees, then place the edges of
+        each chunk (counting sort; the order of the edges of a node is kept,
+        as in from_edges). The self-loops are dropped, the duplicates kept.
+        n_nodes is 1 + the max node id if not given.
+        """
+        counts = np.zeros(0, dtype=np.int64)
+        for chunk in chunks:
+            src, dst = cls._chunk_edges(chunk)
+            if src.size == 0:
+                continue
+            n = int(max(src.max(), dst.max())) + 1
+            if n > counts.size:
+                counts = np.concatenate([counts, np.zeros(n-counts.size, dtype=np.int64)])
+            counts += np.bincount(src, minlength=counts.size)
+        if n_nodes is None:
+            n_nodes = counts.size
+        elif n_nodes < counts.size:
+            raise ValueError("n_nodes should be > the max node id ({}).".format(counts.size-1))
+        if counts.sum() >= np.iinfo(np.int32).max:
+            raise ValueError("the network has too many edges for the int32 CSR arrays.")
+
+        indptr = np.zeros(n_nodes+1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:counts.size+1])
+        indptr[counts.size+1:] = indptr[counts.size]
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        cursor = indptr[:-1].copy()
+        for chunk in chunks:
+            src, dst = cls._chunk_edges(chunk)
+            chunk_counts = np.bincount(src, minlength=n_nodes)
+            # the stable order by src, from the (unique) keys src*size + position (faster than a stable argsort)
+            order = np.sort(src*src.size + np.arange(src.size)) % max(src.size, 1)
+            src_sorted = src[order]
+            first = np.cumsum(chunk_counts) - chunk_counts
+            indices[(cursor-first)[src_sorted] + np.arange(src.size)] = dst[order]
+            cursor += chunk_counts
+        return cls(indptr, indices)
+
+    @classmethod
+    def from_edge_file(cls, path:str, n_nodes=None, chunk_size=EDGE_CHUNK) -> "CSRNetwork":
+        """ Build from the edge list file path (see open_edge_list and from_edge_chunks). """
+        return cls.from_edge_chunks(open_edge_list(path, chunk_size), n_nodes=n_nodes)
+
+    def tile(self, n_blocks:int) -> "CSRNetwork":
+        """ n_blocks disconnected copies of the network, the nodes of the copy b shifted by b*n_nodes. """
+        if n_blocks == 1:
+            return self
+        blocks = np.arange(n_blocks, dtype=np.int64)[:, np.newaxis]
+        indices = (self.indices[np.newaxis] + blocks*self.n_nodes).ravel()
+        indptr = np.concatenate([[0], (self.indptr[np.newaxis, 1:] + blocks*self.n_edges).ravel()])
+        return CSRNetwork(indptr, indices)
+
+    def save(self, path:str) -> None:
+        """ Save the CSR arrays to path (.npz). """
+        np.savez(path, indptr=self.indptr, indices=self.indices)
+
+    @classmethod
+    def load(cls, path:str) -> "CSRNetwork":
+        with np.load(path) as f:
+            return cls(f["indptr"], f["indices"])
+
+
+def open_edge_list(path:str, chunk_size=EDGE_CHUNK) -> list:
+    """
+    The directed edges (src -> dst, node ids from 0) of the file path, as a
+    list of (n, 2) integer chunks of at most chunk_size edges. By extension:
+    1. .npy: an (E, 2) integer array, memory-mapped (the chunks are views)
+    2. .bin: raw native int32 (src, dst) pairs, memory-mapped
+    3. anything else: text, one edge per line, "src dst" or "src,dst" (the
+       extra columns and the lines starting with # or % are ignored), parsed
+       chunk_size lines at a time
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == ".npy":
+        edges = np.load(path, mmap_mode="r")
+    elif ext == ".bin":
+        edges = np.memmap(path, dtype=np.int32, mode="r")
+    else:
+        return _parse_edge_text(path, chunk_size)
+
+    if edges.size % 2 or (edges.ndim == 2 and edges.shape[1] != 2) or edges.ndim > 2:
+        raise ValueError("{} should hold (src, dst) pairs.".format(path))
+    edges = edges.reshape(-1, 2)
+    return [edges[start:start+chunk_size] for start in range(0, edges.shape[0], chunk_size)]
+
+
+def _parse_edge_text(path:str, chunk_size:int) -> list:
+    chunks, delimiter = list(), None
+    with open(path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                return chunks
+            if delimiter is None:
+                data = [line for line in lines[:100] if line.strip() and line.lstrip()[0] not in "#%"]
+                delimiter = "," if data and "," in data[0] else " "
+            with warnings.catch_warnings():
+                # a chunk of comments only
+                warnings.simplefilter("ignore", UserWarning)
+                edges = np.loadtxt(lines, dtype=np.int64, comments=("#", "%"),
+                    delimiter=None if delimiter == " " else delimiter, usecols=(0, 1), ndmin=2)
+            if edges.size and (edges.min() < 0 or edges.max() >= np.iinfo(np.int32).max):
+                raise ValueError("the node ids should be in [0, 2**31-1).")
+            chunks.append(edges.reshape(-1, 2).astype(np.int32))
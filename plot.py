@@ -1,5 +1,8 @@
 import itertools
+import matplotlib
+matplotlib.use("Agg") # headless rendering
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import numpy as np
 import os
 
@@ -25,15 +28,82 @@ class PlotLinesHandler(object):
         # ax.set_ylim([-1.5, 1.5])
         ax.set_xlim([0, x_lim])
 
-    def plot_line(self, data,
+    def plot_line(self, data, x=None,
         linewidth=1, color="", alpha=1.0):
 
         plt.figure(self.id)
+        if x is None:
+            x = np.arange(data.shape[-1])
         if color:
-            plt.plot(np.arange(data.shape[-1]), data,
+            plt.plot(x, data,
                 linewidth=linewidth, color=color, alpha=alpha)
         else:
-            plt.plot(np.arange(data.shape[-1]), data, linewidth=linewidth)
+            plt.plot(x, data, linewidth=linewidth)
+
+    def plot_lines(self, data, x=None, colors=None,
+        linewidth=1, alpha=1.0):
+        """
+        Draw all the columns of data (shaped (n_steps, n_lines)) as one LineCollection.
+        colors is a color or a list of one color per line.
+        """
+        plt.figure(self.id)
+        data = np.asarray(data, dtype=float)
+        if x is None:
+            x = np.arange(data.shape[0])
+        segments = np.empty((data.shape[1], data.shape[0], 2))
+        segments[:, :, 0] = x
+        segments[:, :, 1] = data.T
+
+        lines = LineCollection(segments, colors=colors, linewidths=linewidth, alpha=alpha)
+        ax = plt.gca()
+        ax.add_collection(lines, autolim=True)
+        ax.autoscale_view()
+
+    def plot_density(self, data, x=None, bins=200, y_range=None,
+        chunk_size=64, cmap="viridis"):
+        """
+        Draw the distribution of the columns of data over time as a
+        (time x value) histogram heatmap, for very large numbers of lines.
+        data may be memory-mapped: it is read chunk_size rows at a time.
+        """
+        if data.shape[1] == 0:
+            raise ValueError("data has no column to draw.")
+        plt.figure(self.id)
+        if x is None:
+            x = np.arange(data.shape[0])
+        if y_range is None:
+            y_range = (float(np.min(data)), float(np.max(data)))
+            if y_range[0] == y_range[1]:
+                y_range = (y_range[0]-0.5, y_range[1]+0.5)
+        edges = np.linspace(y_range[0], y_range[1], bins+1)
+
+        density = np.zeros((data.shape[0], bins))
+        for start in range(0, data.shape[0], chunk_size):
+            chunk = np.asarray(data[start:start+chunk_size], dtype=float)
+            bin_idx = np.clip(np.searchsorted(edges, chunk, side="right")-1, 0, bins-1)
+            bin_idx += bins * np.arange(chunk.shape[0])[:, np.newaxis]
+            density[start:start+chunk.shape[0]] = np.bincount(bin_idx.ravel(),
+                minlength=chunk.shape[0]*bins).reshape(chunk.shape[0], bins)
+
+        self.plot_hist(density, x=x, edges=edges, cmap=cmap)
+
+    def plot_hist(self, hist, x, edges, cmap="viridis"):
+        """
+        Draw per-step histograms (hist shaped (n_steps, bins), on the bin
+        edges) as a (time x value) heatmap of the fraction of individuals.
+        """
+        plt.figure(self.id)
+        hist = np.asarray(hist, dtype=float)
+        total = hist.sum(axis=1, keepdims=True)
+        ax = plt.gca()
+        mesh = ax.pcolormesh(x, 0.5*(edges[1:]+edges[:-1]), (hist / np.maximum(total, 1)).T,
+            shading="nearest", cmap=cmap)
+        plt.colorbar(mesh, ax=ax, label="fraction of individuals")
+
+    def plot_band(self, lower, upper, x, color, alpha=0.2):
+        """ Shade the area between the lower and upper curves. """
+        plt.figure(self.id)
+        plt.fill_between(x, lower, upper, color=color, alpha=alpha, linewidth=0)
 
     def save_fig(self, title_param=""):
         if not os.path.exists(self.output_dir):
@@ -43,4 +113,4 @@ class PlotLinesHandler(object):
         fn = "_".join([self.title, title_param]) + ".png"
             
         plt.savefig(os.path.join(self.output_dir, fn))
-        print("fig save to {}".format(os.path.join(self.output_dir, fn)))
\ No newline at end of file
+        print("fig save to {}".format(os.path.join(self.output_dir, fn)))
\ No newline at end of file
@@ -0,0 +1,83 @@
+import time
+import numpy as np
+
+
+class StepProfiler(object):
+    """
+    Opt-in instrumentation of InnovationDiffusion.simulate_step: the wall
+    time of each phase and event counters, one row per timestep.
+    The model only calls it when model.profiler is not None (see from_args,
+    or set model.profiler = StepProfiler(args.n_steps) by hand).
+
+    phases:
+        media: the information from the media
+        discuss: the discussion pass (contacts drawn and processed)
+        update: the status update of every agent (synchronous mode only)
+        record: the trajectory and population counts recording
+    counters:
+        queued: the discussion-queue entries pending before the discussion pass
+        max_queue: the longest queue of an agent at that point
+        contacts: the neighbors contacted
+        influence: the influence updates applied (h_ij > soc_U)
+        omega: the information transfers (successful omega draws)
+    """
+
+    PHASES = ("media", "discuss", "update", "record")
+    COUNTERS = ("queued", "max_queue", "contacts", "influence", "omega")
+
+    def __init__(self, n_steps:int) -> None:
+        super().__init__()
+        self.columns = ["timestep"] + [phase+"_s" for phase in self.PHASES] + list(self.COUNTERS)
+        self._col = {name: col for col, name in enumerate(self.columns)}
+        self._col.update({phase: self._col[phase+"_s"] for phase in self.PHASES})
+        self.table = np.zeros((n_steps+1, len(self.columns)))
+        self.n_recorded = 0
+
+        self.timestep = 0
+        self._t = None
+
+    @staticmethod
+    def from_args(args) -> "StepProfiler":
+        if args.profile_out is None:
+            return None
+        return StepProfiler(args.n_steps)
+
+    def start(self, timestep) -> None:
+        """ Start the row of timestep and its first phase. """
+        self.timestep = timestep
+        self.table[timestep] = 0.0
+        self.table[timestep, 0] = timestep
+        self.n_recorded = max(self.n_recorded, timestep)
+        self._t = time.perf_counter()
+
+    def lap(self, phase:str) -> None:
+        """ End the current phase (the time since the last start/lap is added to phase). """
+        now = time.perf_counter()
+        self.table[self.timestep, self._col[phase]] += now - self._t
+        self._t = now
+
+    def add(self, **counts) -> None:
+        """ Add the counts (e.g. contacts=n) to the counters of the current step. """
+        for name, n in counts.items():
+            self.table[self.timestep, self._col[name]] += n
+
+    def set_queues(self, queued, max_queue) -> None:
+        """ Set the queue counters; the time since the last lap (spent measuring them) is not counted. """
+        self.table[self.timestep, self._col["queued"]] = queued
+        self.table[self.timestep, self._col["max_queue"]] = max_queue
+        self._t = time.perf_counter()
+
+    def get_table(self) -> np.ndarray:
+        """ Return the (n_recorded_steps, len(self.columns)) table of the steps 1, 2, ... """
+        return self.table[1:self.n_recorded+1]
+
+    def get_totals(self) -> dict:
+        """ The phase times and counters summed over the steps (max_queue: the max). """
+        table = self.get_table()
+        totals = {name: float(table[:, col].sum()) for col, name in enumerate(self.columns[1:], start=1)}
+        totals["max_queue"] = float(table[:, self._col["max_queue"]].max(initial=0))
+        return totals
+
+    def save(self, path:str) -> None:
+        np.savetxt(path, self.get_table(), fmt="%.9g", delimiter=",", header=",".join(self.columns), comments="")
+        print("profile save to {}".format(path))
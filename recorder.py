@@ -0,0 +1,333 @@
+import json
+import os
+import numpy as np
+
+
+class TrajectoryRecorder(object):
+    """
+    Preallocated buffer for the social opinions over time.
+    Only every stride-th timestep (starting from 0) and the agents in
+    agent_idx (all of them if None) are kept.
+    """
+
+    def __init__(self, n_steps:int, n_agents:int, dtype="float64",
+        stride=1, agent_idx=None) -> None:
+        super().__init__()
+
+        if stride < 1:
+            raise ValueError("stride should be >= 1.")
+
+        self.stride = int(stride)
+        self.n_agents = n_agents
+        self.agent_idx = None if agent_idx is None else np.asarray(agent_idx, dtype=np.int64)
+        self.steps = np.arange(0, n_steps+1, self.stride)
+
+        self.n_cols = n_agents if self.agent_idx is None else self.agent_idx.size
+        self.fields = ("soc_op",)
+        self.is_extrem = None
+        self.buffer = self._alloc("soc_op", dtype)
+        self.buffers = {"soc_op": self.buffer}
+        self.n_recorded = 0
+
+    @staticmethod
+    def from_args(args, mode="w+") -> "TrajectoryRecorder":
+        """ mode: the mode the MemmapTrajectoryWriter files are opened with (r+ to continue a run). """
+        agent_idx = TrajectoryRecorder.agent_idx_from_args(args)
+        if args.traj_out is not None:
+            return MemmapTrajectoryWriter(args.traj_out, args.n_steps, args.N, dtype=args.traj_dtype,
+                stride=args.traj_stride, agent_idx=agent_idx, fields=args.traj_fields.split(","), args=args, mode=mode)
+        return TrajectoryRecorder(args.n_steps, args.N, dtype=args.traj_dtype,
+            stride=args.traj_stride, agent_idx=agent_idx)
+
+    @staticmethod
+    def agent_idx_from_args(args) -> np.ndarray:
+        """ The ids of the args.traj_n_agents recorded agents; None if all of them are recorded. """
+        if args.traj_n_agents is None or args.traj_n_agents >= args.N:
+            return None
+        # evenly spaced ids, so that no random number is consumed
+        return np.linspace(0, args.N-1, args.traj_n_agents).round().astype(np.int64)
+
+    def _alloc(self, field:str, dtype) -> np.ndarray:
+        return np.empty((self.steps.size, self.n_cols), dtype=dtype)
+
+    def set_is_extrem(self, is_extrem) -> None:
+        """ Keep the extremist flags of the recorded agents (for plotting). """
+        is_extrem = np.asarray(is_extrem, dtype=bool)
+        self.is_extrem = is_extrem if self.agent_idx is None else is_extrem[self.agent_idx]
+
+    def wants(self, timestep) -> bool:
+        return timestep % self.stride == 0 and timestep // self.stride < self.steps.size
+
+    def _select(self, values) -> np.ndarray:
+        values = np.asarray(values)
+        if self.agent_idx is not None and values.shape[0] == self.n_agents:
+            values = values[self.agent_idx]
+        return values
+
+    def record(self, timestep, soc_op, **kwargs) -> None:
+        """
+        soc_op holds the opinions of all the agents (or of agent_idx only).
+        Other fields (decision, info) are ignored by the in-memory recorder.
+        """
+        if not self.wants(timestep):
+            return
+        row = timestep // self.stride
+        self.buffer[row] = self._select(soc_op)
+        self.n_recorded = row + 1
+
+    def fill_to_end(self) -> None:
+        """ Repeat the last recorded row in all the remaining rows (e.g. after an early stop). """
+        if self.n_recorded == 0:
+            return
+        for buffer in self.buffers.values():
+            buffer[self.n_recorded:] = buffer[self.n_recorded-1]
+        self.n_recorded = self.steps.size
+
+    def flush(self) -> None:
+        pass
+
+    def get_state(self, with_buffers=True) -> dict:
+        """ The number of recorded rows and, if with_buffers, the recorded rows of every field. """
+        state = {"n_recorded": np.array(self.n_recorded)}
+        if with_buffers:
+            state.update({"buffer."+field: buffer[:self.n_recorded] for field, buffer in self.buffers.items()})
+        return state
+
+    def set_state(self, state:dict) -> None:
+        """ Restore get_state; the fields missing in state are left as they are. """
+        n_recorded = int(state["n_recorded"])
+        if n_recorded > self.steps.size:
+            raise ValueError("the state has more recorded steps than the recorder.")
+        for field, buffer in self.buffers.items():
+            if "buffer."+field in state:
+                buffer[:n_recorded] = state["buffer."+field]
+        self.n_recorded = n_recorded
+
+    def get(self) -> np.ndarray:
+        """ Return a (n_recorded_steps, n_recorded_agents) view. """
+        return self.buffer[:self.n_recorded]
+
+    def get_steps(self) -> np.ndarray:
+        return self.steps[:self.n_recorded]
+
+    def get_agent_idx(self) -> np.ndarray:
+        return np.arange(self.n_agents) if self.agent_idx is None else self.agent_idx
+
+
+class MemmapTrajectoryWriter(TrajectoryRecorder):
+    """
+    Stream the trajectories to memory-mapped .npy files in out_dir, one
+    file per field ("soc_op", "decision", "info"), so that the full history
+    is never held in RAM. Reopen them lazily with load_trajectory(out_dir).
+    mode "r+" reopens the files of a previous run (to continue it, see
+    InnovationDiffusion.resume) instead of creating them.
+    """
+
+    FIELD_DTYPES = {"decision": np.int8, "info": np.bool_}
+
+    def __init__(self, out_dir:str, n_steps:int, n_agents:int, dtype="float64",
+        stride=1, agent_idx=None, fields=("soc_op",), args=None, mode="w+") -> None:
+        for field in fields:
+            if field not in ("soc_op", "decision", "info"):
+                raise ValueError("unknown trajectory field: {}.".format(field))
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        self.out_dir = out_dir
+        self.args = args
+        self.mode = mode
+        super().__init__(n_steps, n_agents, dtype=dtype, stride=stride, agent_idx=agent_idx)
+
+        self.fields = ("soc_op",) + tuple(f for f in fields if f != "soc_op")
+        self.buffers = {"soc_op": self.buffer}
+        for field in self.fields[1:]:
+            self.buffers[field] = self._alloc(field, self.FIELD_DTYPES[field])
+        self.flush()
+
+    def _alloc(self, field:str, dtype) -> np.ndarray:
+        fn = os.path.join(self.out_dir, field+".npy")
+        if self.mode == "r+":
+            buffer = np.lib.format.open_memmap(fn, mode="r+")
+            if buffer.shape != (self.steps.size, self.n_cols):
+                raise ValueError("{} does not have the shape of the trajectory.".format(fn))
+            return buffer
+        return np.lib.format.open_memmap(fn, mode="w+", dtype=dtype, shape=(self.steps.size, self.n_cols))
+
+    def set_is_extrem(self, is_extrem) -> None:
+        super().set_is_extrem(is_extrem)
+        np.save(os.path.join(self.out_dir, "is_extrem.npy"), self.is_extrem)
+
+    def record(self, timestep, soc_op, **kwargs) -> None:
+        """ kwargs holds the arrays of the extra fields (decision, info). """
+        if not self.wants(timestep):
+            return
+        row = timestep // self.stride
+        self.buffer[row] = self._select(soc_op)
+        for field in self.fields[1:]:
+            self.buffers[field][row] = self._select(kwargs[field])
+        self.n_recorded = row + 1
+
+    def get_state(self, with_buffers=False) -> dict:
+        """ The rows are on disk: only the count is saved, unless with_buffers. """
+        self.flush()
+        return super().get_state(with_buffers)
+
+    def flush(self) -> None:
+        for buffer in self.buffers.values():
+            buffer.flush()
+        meta = {
+            "n_recorded": self.n_recorded,
+            "stride": self.stride,
+            "n_agents": self.n_agents,
+            "fields": list(self.fields),
+            "args": None if self.args is None else vars(self.args),
+        }
+        np.save(os.path.join(self.out_dir, "steps.npy"), self.steps)
+        np.save(os.path.join(self.out_dir, "agent_idx.npy"), self.get_agent_idx())
+        with open(os.path.join(self.out_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+def load_trajectory(out_dir:str) -> dict:
+    """
+    Lazily reopen the files written by MemmapTrajectoryWriter. Return a dict
+    with the read-only memory-mapped fields (cut to the recorded steps),
+    "steps", "agent_idx", "is_extrem" (None if not saved) and "meta".
+    """
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        meta = json.load(f)
+    n_recorded = meta["n_recorded"]
+
+    res = {"meta": meta}
+    for field in meta["fields"]:
+        res[field] = np.load(os.path.join(out_dir, field+".npy"), mmap_mode="r")[:n_recorded]
+    res["steps"] = np.load(os.path.join(out_dir, "steps.npy"))[:n_recorded]
+    res["agent_idx"] = np.load(os.path.join(out_dir, "agent_idx.npy"))
+    is_extrem_fn = os.path.join(out_dir, "is_extrem.npy")
+    res["is_extrem"] = np.load(is_extrem_fn) if os.path.exists(is_extrem_fn) else None
+    return res
+
+
+class OpinionStatsRecorder(object):
+    """
+    Streaming summaries of the distribution of the social opinions, in
+    O(n_steps * bins) memory whatever the number of agents. For each
+    recorded step (every stride-th) and each group of agents (all,
+    extremists, moderates):
+    1. the histogram on bins fixed bins over value_range (the opinions
+       out of the range are counted in the edge bins)
+    2. the count, mean and variance
+    3. the QUANTILES
+    4. the number of clusters: the maximal runs of bins holding at least
+       cluster_min_frac of the group
+    """
+
+    GROUPS = ("all", "extremists", "moderates")
+    QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+    FIELDS = ("hist", "count", "mean", "var", "quantiles", "n_clusters")
+
+    def __init__(self, n_steps:int, bins=100, value_range=(-2.0, 2.0), stride=1, cluster_min_frac=0.005) -> None:
+        super().__init__()
+
+        if stride < 1:
+            raise ValueError("stride should be >= 1.")
+        if not value_range[0] < value_range[1]:
+            raise ValueError("value_range should be increasing.")
+
+        self.stride = int(stride)
+        self.steps = np.arange(0, n_steps+1, self.stride)
+        self.edges = np.linspace(value_range[0], value_range[1], bins+1)
+        self.cluster_min_frac = cluster_min_frac
+        self.is_extrem = None
+
+        shape = (self.steps.size, len(self.GROUPS))
+        self.hist = np.zeros(shape + (bins,), dtype=np.int64)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.full(shape, np.nan)
+        self.var = np.full(shape, np.nan)
+        self.quantiles = np.full(shape + (len(self.QUANTILES),), np.nan)
+        self.n_clusters = np.zeros(shape, dtype=np.int64)
+        self.n_recorded = 0
+
+    @staticmethod
+    def from_args(args) -> "OpinionStatsRecorder":
+        if not args.opinion_stats:
+            return None
+        return OpinionStatsRecorder(args.n_steps, bins=args.stats_bins, value_range=tuple(args.stats_range),
+            stride=args.traj_stride)
+
+    def set_is_extrem(self, is_extrem) -> None:
+        self.is_extrem = np.asarray(is_extrem, dtype=bool)
+
+    def wants(self, timestep) -> bool:
+        return timestep % self.stride == 0 and timestep // self.stride < self.steps.size
+
+    @staticmethod
+    def count_clusters(hist:np.ndarray, min_count) -> int:
+        """ The number of maximal runs of bins of hist with at least min_count (>= 1) values. """
+        occupied = hist >= max(1, min_count)
+        return int(occupied[0]) + int(np.count_nonzero(occupied[1:] & ~occupied[:-1]))
+
+    def record(self, timestep, soc_op) -> None:
+        """ soc_op holds the opinions of all the agents. """
+        if not self.wants(timestep):
+            return
+        row = timestep // self.stride
+        soc_op = np.asarray(soc_op, dtype=float)
+        is_extrem = np.zeros(soc_op.size, dtype=bool) if self.is_extrem is None else self.is_extrem
+        bins = self.edges.size - 1
+
+        for group, values in enumerate((soc_op, soc_op[is_extrem], soc_op[~is_extrem])):
+            self.count[row, group] = values.size
+            if values.size == 0:
+                self.hist[row, group] = 0
+                self.mean[row, group] = self.var[row, group] = np.nan
+                self.quantiles[row, group] = np.nan
+                self.n_clusters[row, group] = 0
+                continue
+            bin_idx = np.clip(np.searchsorted(self.edges, values, side="right")-1, 0, bins-1)
+            self.hist[row, group] = np.bincount(bin_idx, minlength=bins)
+            self.mean[row, group] = values.mean()
+            self.var[row, group] = values.var()
+            self.quantiles[row, group] = np.quantile(values, self.QUANTILES)
+            self.n_clusters[row, group] = self.count_clusters(self.hist[row, group], self.cluster_min_frac*values.size)
+        self.n_recorded = row + 1
+
+    def fill_to_end(self) -> None:
+        """ Repeat the last recorded row in all the remaining rows (e.g. after an early stop). """
+        if self.n_recorded == 0:
+            return
+        for field in self.FIELDS:
+            values = getattr(self, field)
+            values[self.n_recorded:] = values[self.n_recorded-1]
+        self.n_recorded = self.steps.size
+
+    def get(self) -> dict:
+        """ The recorded summaries (the first axis is the step, the second the group), with "steps" and "edges". """
+        res = {field: getattr(self, field)[:self.n_recorded] for field in self.FIELDS}
+        res.update({"steps": self.steps[:self.n_recorded], "edges": self.edges,
+                    "groups": np.array(self.GROUPS), "quantile_levels": np.array(self.QUANTILES)})
+        return res
+
+    def get_state(self) -> dict:
+        state = {field: getattr(self, field)[:self.n_recorded] for field in self.FIELDS}
+        state["n_recorded"] = np.array(self.n_recorded)
+        return state
+
+    def set_state(self, state:dict) -> None:
+        n_recorded = int(state["n_recorded"])
+        if n_recorded > self.steps.size:
+            raise ValueError("the state has more recorded steps than the recorder.")
+        for field in self.FIELDS:
+            getattr(self, field)[:n_recorded] = state[field]
+        self.n_recorded = n_recorded
+
+    def save(self, path:str) -> None:
+        """ Save get() to path (.npz), see load_opinion_stats. """
+        np.savez(path, **self.get())
+        print("opinion stats save to {}".format(path))
+
+
+def load_opinion_stats(path:str) -> dict:
+    """ Reload the summaries saved by OpinionStatsRecorder.save. """
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
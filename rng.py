@@ -0,0 +1,67 @@
+import json
+import numpy as np
+
+
+class RandomPool(object):
+    """
+    Scalar random numbers served from blocks pre-drawn with a
+    np.random.Generator, so that the per-agent calls of the object engine
+    do not pay the per-call Generator overhead.
+    """
+
+    def __init__(self, rng: np.random.Generator, block_size=4096) -> None:
+        super().__init__()
+        self.rng = rng
+        self.block_size = block_size
+
+        self._uniform, self._uniform_pos = list(), 0
+        self._normal, self._normal_pos = list(), 0
+
+    def uniform(self) -> float:
+        """ A draw from U[0, 1). """
+        if self._uniform_pos == len(self._uniform):
+            self._uniform, self._uniform_pos = self.rng.random(self.block_size).tolist(), 0
+        self._uniform_pos += 1
+        return self._uniform[self._uniform_pos-1]
+
+    def normal(self, loc=0.0, scale=1.0) -> float:
+        if self._normal_pos == len(self._normal):
+            self._normal, self._normal_pos = self.rng.standard_normal(self.block_size).tolist(), 0
+        self._normal_pos += 1
+        return loc + scale * self._normal[self._normal_pos-1]
+
+    def get_state(self) -> dict:
+        """ The pre-drawn numbers not served yet (the state of self.rng is saved apart, see get_rng_state). """
+        return {"uniform": np.array(self._uniform[self._uniform_pos:], dtype=float),
+                "normal": np.array(self._normal[self._normal_pos:], dtype=float)}
+
+    def set_state(self, state:dict) -> None:
+        self._uniform, self._uniform_pos = state["uniform"].tolist(), 0
+        self._normal, self._normal_pos = state["normal"].tolist(), 0
+
+
+def get_rng_state(rng: np.random.Generator) -> np.ndarray:
+    """ The bit generator state of rng as a (json) string array, to be saved with np.savez. """
+    return np.array(json.dumps(rng.bit_generator.state))
+
+
+def set_rng_state(rng: np.random.Generator, state:np.ndarray) -> None:
+    rng.bit_generator.state = json.loads(str(state))
+
+
+def derive_seed(rnd_seed, name:str) -> np.random.SeedSequence:
+    """
+    The SeedSequence of the named stream of rnd_seed (int or SeedSequence),
+    independent of the stream of np.random.default_rng(rnd_seed).
+    """
+    if not isinstance(rnd_seed, np.random.SeedSequence):
+        rnd_seed = np.random.SeedSequence(rnd_seed)
+    return np.random.SeedSequence(rnd_seed.entropy,
+        spawn_key=tuple(rnd_seed.spawn_key) + (int.from_bytes(name.encode(), "little"),))
+
+
+def spawn_seeds(rnd_seed, n:int) -> list:
+    """ n independent np.random.SeedSequence children of rnd_seed (int or SeedSequence). """
+    if not isinstance(rnd_seed, np.random.SeedSequence):
+        rnd_seed = np.random.SeedSequence(rnd_seed)
+    return rnd_seed.spawn(n)
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class ActiveSet(object):
+    """
+    Ids of the agents with pending discussion-queue entries, so that the
+    shuffled discussion pass only visits the agents with something to do.
+    """
+
+    def __init__(self, n_agents:int) -> None:
+        super().__init__()
+        self.is_active = np.zeros(n_agents, dtype=bool)
+        self._chunks = list()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, idx) -> None:
+        """ Mark the agents in idx (array of ids, duplicates allowed) as active. """
+        idx = np.asarray(idx, dtype=np.int64)
+        idx = np.unique(idx[~self.is_active[idx]])
+        if idx.size == 0:
+            return
+        self.is_active[idx] = True
+        self._chunks.append(idx)
+        self._size += idx.size
+
+    def pop_shuffled(self, rng: np.random.Generator) -> np.ndarray:
+        """ Return the active ids in a random order and empty the set. """
+        if not self._chunks:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(self._chunks)
+        self.is_active[ids] = False
+        self._chunks, self._size = list(), 0
+        return rng.permutation(ids)
+
+    def get_state(self) -> dict:
+        """ The active ids, in the order pop_shuffled permutes them. """
+        ids = np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=np.int64)
+        return {"ids": ids}
+
+    def set_state(self, state:dict) -> None:
+        ids = state["ids"].astype(np.int64)
+        self.is_active[:] = False
+        self.is_active[ids] = True
+        self._chunks = [ids] if ids.size else list()
+        self._size = ids.size
@@ -0,0 +1,280 @@
+import copy
+import csv
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+
+from args import ArgsConfig
+from main import InnovationDiffusion, MODEL_VERSION
+from cache import ResultStore
+from rng import spawn_seeds
+
+# rnd_seed is the base seed; the run used its SeedSequence child of spawn_key
+# (np.random.SeedSequence(rnd_seed, spawn_key=...) rebuilds it)
+TABLE_FIELDS = ["first_stage", "second_stage", "run", "rnd_seed", "spawn_key",
+                "net_media", "sd_s", "ratio_ex", "U_s", "m_s", "m_i",
+                "informed", "adopters", "not_concern"]
+# the fields that identify a cell
+CELL_FIELDS = ["first_stage", "second_stage", "net_media", "sd_s", "ratio_ex", "U_s", "m_s", "m_i"]
+
+
+def make_cells(args, firsts=range(16), seconds=range(8),
+    first_dicts=None, second_dicts=None) -> list:
+    """
+    The args of each (first stage x second stage) cell.
+    first_dicts/second_dicts (lists of dict) replace the int stages if given.
+    """
+    if first_dicts is not None:
+        firsts = [(ArgsConfig.set_config_first_dict, d) for d in first_dicts]
+    else:
+        firsts = [(ArgsConfig.set_config_first, int(f)) for f in firsts]
+    if second_dicts is not None:
+        seconds = [(ArgsConfig.set_config_second_dict, d) for d in second_dicts]
+    else:
+        seconds = [(ArgsConfig.set_config_second, int(s)) for s in seconds]
+
+    cells = list()
+    for set_first, first in firsts:
+        for set_second, second in seconds:
+            cell_args = set_second(set_first(copy.copy(args), first), second)
+            # only the final result is collected: do not keep trajectories, and do not let
+            # the runs write their per-run outputs to the same paths
+            cell_args.traj_n_agents, cell_args.traj_out = 0, None
+            cell_args.checkpoint_out, cell_args.profile_out, cell_args.stats_out = None, None, None
+            cell_args.opinion_stats = False
+            cells.append(cell_args)
+    return cells
+
+
+def make_tasks(args, firsts=range(16), seconds=range(8),
+    first_dicts=None, second_dicts=None, n_runs=None) -> list:
+    """
+    Expand the (first stage x second stage x n_runs) grid into tasks.
+    A task is the args of one run, its index and its random seed: the run r of
+    every cell uses the r-th SeedSequence child of args.rnd_seed.
+    """
+    n_runs = args.n_runs if n_runs is None else n_runs
+    seeds = spawn_seeds(args.rnd_seed, n_runs)
+    return [(cell_args, run, seeds[run]) for cell_args in make_cells(args, firsts, seconds, first_dicts, second_dicts)
+            for run in range(n_runs)]
+
+
+def run_task(task) -> dict:
+    """ Run a task, or reuse its result from the store in args.cache_dir. """
+    args, run, rnd_seed = task
+    store = ResultStore.from_args(args, MODEL_VERSION)
+    cached = None if store is None else store.get(args, rnd_seed)
+    if cached is not None:
+        informed, adopters, not_concern = cached["result"]
+    else:
+        game = InnovationDiffusion(args, rnd_seed=rnd_seed, verbose=False)
+        game.simulate()
+        informed, adopters, not_concern = game.get_result()
+        if store is not None:
+            store.put(args, rnd_seed, game, with_traj=args.cache_traj)
+
+    row = {field: getattr(args, field, None) for field in TABLE_FIELDS}
+    spawn_key = list(rnd_seed.spawn_key) if isinstance(rnd_seed, np.random.SeedSequence) else []
+    row.update({"run": run, "rnd_seed": args.rnd_seed, "spawn_key": json.dumps(spawn_key), "informed": float(informed),
+                "adopters": float(adopters), "not_concern": float(not_concern)})
+    return row
+
+
+def run_sweep(tasks, n_workers=None, chunksize=1, verbose=True) -> list:
+    """ Run the tasks on a process pool and return the result rows in the order of the tasks. """
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    start = time.time()
+
+    if n_workers <= 1:
+        rows = list(map(run_task, tasks))
+    else:
+        with mp.Pool(n_workers) as pool:
+            rows = list()
+            for row in pool.imap(run_task, tasks, chunksize=chunksize):
+                rows.append(row)
+                if verbose and len(rows) % max(1, len(tasks)//20) == 0:
+                    print("| {}/{} tasks | {:.1f}s".format(len(rows), len(tasks), time.time()-start))
+
+    if verbose:
+        print("{} tasks done with {} workers in {:.1f}s".format(len(tasks), n_workers, time.time()-start))
+    return rows
+
+
+def t_cdf_abs(t:float, df:int) -> float:
+    """ P(|T| < t) for the Student t distribution with df (int) degrees of freedom (Abramowitz & Stegun 26.7.3-4). """
+    theta = math.atan(t / math.sqrt(df))
+    cos2 = math.cos(theta)**2
+    if df % 2 == 1:
+        # 2/pi * (theta + sin cos (1 + 2/3 cos^2 + 2*4/(3*5) cos^4 + ...)), (df-1)/2 terms
+        term, total = math.cos(theta), 0.0
+        for k in range(1, (df-1)//2 + 1):
+            total += term
+            term *= 2*k / (2*k+1) * cos2
+        return 2/math.pi * (theta + math.sin(theta) * total)
+    # sin (1 + 1/2 cos^2 + 1*3/(2*4) cos^4 + ...), df/2 terms
+    term, total = 1.0, 0.0
+    for k in range(1, df//2 + 1):
+        total += term
+        term *= (2*k-1) / (2*k) * cos2
+    return math.sin(theta) * total
+
+
+def t_quantile(level:float, df:int) -> float:
+    """ The t such that P(|T| < t) = level, T of Student with df degrees of freedom (bisection on t_cdf_abs). """
+    lo, hi = 0.0, 1.0
+    while t_cdf_abs(hi, df) < level:
+        lo, hi = hi, 2*hi
+    for _ in range(100):
+        mid = (lo+hi) / 2
+        if t_cdf_abs(mid, df) < level:
+            lo = mid
+        else:
+            hi = mid
+    return (lo+hi) / 2
+
+
+def ci_width(values, level=0.95) -> float:
+    """ The width of the (Student t) confidence interval of the mean of values; inf for < 2 values. """
+    values = np.asarray(values, dtype=float)
+    if values.size < 2:
+        return math.inf
+    return float(2 * t_quantile(level, values.size-1) * values.std(ddof=1) / math.sqrt(values.size))
+
+
+def run_adaptive(cells, rnd_seed, ci_target:float, min_runs=5, max_runs=100, budget=None, level=0.95,
+    n_workers=None, chunksize=1, verbose=True) -> list:
+    """
+    Run the replicates of the cells (list of args, see make_cells) in rounds,
+    until the confidence intervals of their informed and adopters ratios are
+    at most ci_target wide.
+    1. every cell runs min_runs replicates
+    2. a cell is done once both CI widths are <= ci_target, or once it has max_runs replicates
+    3. each round, an unfinished cell asks for the runs its current sd needs
+       to reach ci_target (at least 1, at most doubling its runs); the widest
+       cells are served first while the budget (total runs, unlimited if None) lasts
+    The run r of every cell uses the r-th SeedSequence child of rnd_seed, as in make_tasks.
+    Return the result rows of all the runs, grouped by cell.
+    """
+    if budget is not None and budget < min_runs * len(cells):
+        raise ValueError("budget should be >= min_runs * the number of cells.")
+    seeds = spawn_seeds(rnd_seed, max_runs)
+    results = [list() for _ in cells]
+    alloc = {cell: min_runs for cell in range(len(cells))}
+    n_used, n_round, start = 0, 0, time.time()
+
+    while alloc:
+        tasks, task_cells = list(), list()
+        for cell, n in alloc.items():
+            for run in range(len(results[cell]), len(results[cell])+n):
+                tasks.append((cells[cell], run, seeds[run]))
+                task_cells.append(cell)
+        for cell, row in zip(task_cells, run_sweep(tasks, n_workers=n_workers, chunksize=chunksize, verbose=False)):
+            results[cell].append(row)
+        n_used += len(tasks)
+        n_round += 1
+
+        # the runs wanted by the unfinished cells, the widest first
+        wanted = list()
+        for cell, rows in enumerate(results):
+            n = len(rows)
+            values = [[row[name] for row in rows] for name in ("informed", "adopters")]
+            width = max(ci_width(v, level) for v in values)
+            if width <= ci_target or n >= max_runs:
+                continue
+            # with the t quantile of the current n (it only decreases with more runs)
+            sd = max(float(np.std(v, ddof=1)) for v in values)
+            n_needed = math.ceil((2*t_quantile(level, n-1)*sd / ci_target)**2) - n
+            wanted.append((width, cell, int(np.clip(n_needed, 1, min(n, max_runs-n)))))
+
+        alloc = dict()
+        n_left = math.inf if budget is None else budget - n_used
+        for width, cell, n in sorted(wanted, reverse=True):
+            n = min(n, n_left)
+            if n <= 0:
+                break
+            alloc[cell] = n
+            n_left -= n
+
+        if verbose:
+            print("| round {} | {} runs ({} in total) | {} cells unfinished, {} continue | {:.1f}s".format(
+                n_round, len(tasks), n_used, len(wanted), len(alloc), time.time()-start))
+    return [row for rows in results for row in rows]
+
+
+def save_table(rows, path:str) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print("table save to {}".format(path))
+
+
+def summarize(rows, level=0.95) -> list:
+    """
+    Mean, sample sd (ddof=1, as in the CI) and CI width (see ci_width) of
+    the ratios over the runs of each (first stage, second stage) cell.
+    """
+    cells = dict()
+    for row in rows:
+        key = tuple(row[field] for field in CELL_FIELDS)
+        cells.setdefault(key, list()).append((row["informed"], row["adopters"], row["not_concern"]))
+
+    res = list()
+    for key, values in cells.items():
+        values = np.array(values)
+        cell = dict(zip(CELL_FIELDS, key))
+        cell["n_runs"] = len(values)
+        for col, name in enumerate(["informed", "adopters", "not_concern"]):
+            cell[name+"_mean"] = float(values[:, col].mean())
+            cell[name+"_sd"] = float(values[:, col].std(ddof=1)) if len(values) > 1 else math.nan
+            cell[name+"_ci"] = ci_width(values[:, col], level)
+        res.append(cell)
+    return res
+
+
+if __name__ == "__main__":
+    parser = ArgsConfig()
+    parser.parser.add_argument("--first_stages", type=int, nargs="+", default=list(range(16)),
+        help="(sweep) the first stage configurations to run.")
+    parser.parser.add_argument("--second_stages", type=int, nargs="+", default=list(range(8)),
+        help="(sweep) the second stage configurations to run.")
+    parser.parser.add_argument("--first_dicts", type=str, default=None,
+        help="(sweep) a json list of first stage dicts, replaces --first_stages.")
+    parser.parser.add_argument("--second_dicts", type=str, default=None,
+        help="(sweep) a json list of second stage dicts, replaces --second_stages.")
+    parser.parser.add_argument("--n_workers", type=int, default=None,
+        help="(sweep) the number of worker processes; all cores if not given.")
+    parser.parser.add_argument("--chunksize", type=int, default=1,
+        help="(sweep) the number of tasks sent to a worker at once.")
+    parser.parser.add_argument("--out", type=str, default="sweep_results.csv",
+        help="(sweep) the output table of the runs.")
+    parser.parser.add_argument("--ci_width", type=float, default=None,
+        help="(sweep) run the replicates in rounds until the CI of the informed/adopters ratios of each cell is this wide (fixed --n_runs if not given).")
+    parser.parser.add_argument("--ci_level", type=float, default=0.95,
+        help="(sweep) the confidence level of the CI.")
+    parser.parser.add_argument("--min_runs", type=int, default=5,
+        help="(sweep, ci_width) the number of replicates of the first round.")
+    parser.parser.add_argument("--max_runs", type=int, default=100,
+        help="(sweep, ci_width) the max number of replicates of a cell.")
+    parser.parser.add_argument("--budget", type=int, default=None,
+        help="(sweep, ci_width) the max total number of runs; unlimited if not given.")
+    args = parser.parser.parse_args()
+
+    first_dicts = None if args.first_dicts is None else json.loads(args.first_dicts)
+    second_dicts = None if args.second_dicts is None else json.loads(args.second_dicts)
+    if args.ci_width is None:
+        tasks = make_tasks(args, args.first_stages, args.second_stages, first_dicts=first_dicts, second_dicts=second_dicts)
+        rows = run_sweep(tasks, n_workers=args.n_workers, chunksize=args.chunksize)
+    else:
+        cells = make_cells(args, args.first_stages, args.second_stages, first_dicts=first_dicts, second_dicts=second_dicts)
+        rows = run_adaptive(cells, args.rnd_seed, args.ci_width, min_runs=args.min_runs, max_runs=args.max_runs,
+            budget=args.budget, level=args.ci_level, n_workers=args.n_workers, chunksize=args.chunksize)
+    save_table(rows, args.out)
+
+    for cell in summarize(rows, level=args.ci_level):
+        print("| first {} second {} | informed: {:.2f}% (CI {:.2f}%); adopters: {:.2f}% (CI {:.2f}%); not_concern: {:.2f}% ({} runs)".format(
+            cell["first_stage"], cell["second_stage"], cell["informed_mean"]*100, cell["informed_ci"]*100,
+            cell["adopters_mean"]*100, cell["adopters_ci"]*100, cell["not_concern_mean"]*100, cell["n_runs"]))
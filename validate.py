@@ -0,0 +1,174 @@
+import copy
+import json
+import sys
+import time
+import numpy as np
+
+from args import ArgsConfig
+from bench import BENCH_STAGES, get_meta
+from main import InnovationDiffusion
+from rng import spawn_seeds
+
+
+def ks_2samp(x, y) -> tuple:
+    """
+    Two-sample Kolmogorov-Smirnov test: return the statistic D (the max
+    distance of the empirical CDFs) and its p-value, from the asymptotic
+    Kolmogorov distribution with the small-sample correction of Stephens (1970).
+    The p-value is conservative for discrete samples (ties).
+    """
+    x, y = np.sort(np.asarray(x, dtype=float)), np.sort(np.asarray(y, dtype=float))
+    n, m = x.size, y.size
+    values = np.concatenate([x, y])
+    d = float(np.abs(np.searchsorted(x, values, side="right")/n - np.searchsorted(y, values, side="right")/m).max())
+
+    en = np.sqrt(n*m / (n+m))
+    lam = (en + 0.12 + 0.11/en) * d
+    if lam < 1e-3:
+        return d, 1.0
+    k = np.arange(1, 101)
+    p = 2 * np.sum((-1.0)**(k-1) * np.exp(-2 * k**2 * lam**2))
+    return d, float(np.clip(p, 0.0, 1.0))
+
+
+def with_overrides(args, overrides:dict):
+    """ A copy of args with overrides (e.g. {"engine": "vector"}) set; unknown arg names raise ValueError. """
+    unknown = set(overrides) - set(ArgsConfig.get_defaults())
+    if unknown:
+        raise ValueError("unknown arguments: {}.".format(", ".join(sorted(unknown))))
+    args = copy.copy(args)
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    return args
+
+
+def run_engine(args, seeds) -> dict:
+    """
+    Run args once per seed (no trajectory, no opinion stats).
+    Return the runs stacked: "result" (n_runs, 3), "counts" (n_runs, n_steps+1, n_cols),
+    "var" (n_runs, n_steps+1) the variance of all the opinions, "columns", "N" and "time_s".
+    time_s only covers __init__ and the steps: the variance is measured between the steps, out of the timing.
+    """
+    args = copy.copy(args)
+    args.traj_n_agents, args.traj_out = 0, None
+    args.opinion_stats, args.stats_out = False, None
+    args.profile_out, args.checkpoint_out, args.cache_dir = None, None, None
+
+    results, counts, var = list(), list(), list()
+    time_s = 0.0
+    for seed in seeds:
+        start = time.perf_counter()
+        game = InnovationDiffusion(args, rnd_seed=seed, verbose=False)
+        steps = game.simulate_iter()
+        time_s += time.perf_counter() - start
+
+        run_var = np.empty(args.n_steps+1)
+        run_var[0] = game.get_soc_op().var()
+        while True:
+            start = time.perf_counter()
+            snapshot = next(steps, None)
+            time_s += time.perf_counter() - start
+            if snapshot is None:
+                break
+            run_var[snapshot.timestep] = game.get_soc_op().var()
+        # after an early stop, as fill_to_end does
+        run_var[game.timestep+1:] = run_var[game.timestep]
+        results.append(game.get_result())
+        counts.append(game.get_count_series())
+        var.append(run_var)
+    return {"result": np.array(results), "counts": np.array(counts), "var": np.array(var),
+            "columns": game.counter.columns, "N": game.args.N, "time_s": time_s}
+
+
+def compare_runs(ref:dict, cand:dict, n_points=10, alpha=0.01) -> dict:
+    """
+    KS-test the distributions over the seeds of:
+    1. the final informed, adopters and not concerned ratios
+    2. the informed and adopters ratios (the adoption curves) at n_points evenly spaced steps
+    3. the variance of the opinions at the same steps
+    The case passes if no p-value is below alpha / the number of tests (Bonferroni).
+    """
+    n_steps, N = ref["counts"].shape[1] - 1, ref["N"]
+    steps = np.unique(np.linspace(1, n_steps, n_points).round().astype(int))
+    samples = [("final_"+name, ref["result"][:, col], cand["result"][:, col])
+               for col, name in enumerate(("informed", "adopters", "not_concern"))]
+    for name in ("informed", "adoption"):
+        col = ref["columns"].index(name)
+        samples += [("{}_t{}".format(name, t), ref["counts"][:, t, col]/N, cand["counts"][:, t, col]/N) for t in steps]
+    samples += [("var_t{}".format(t), ref["var"][:, t], cand["var"][:, t]) for t in steps]
+
+    tests = list()
+    for name, x, y in samples:
+        d, p = ks_2samp(x, y)
+        tests.append({"name": name, "ref_mean": float(x.mean()), "cand_mean": float(y.mean()), "D": d, "p": p})
+    threshold = alpha / len(tests)
+    return {"tests": tests, "threshold": threshold, "min_p": min(test["p"] for test in tests),
+            "passed": all(test["p"] >= threshold for test in tests)}
+
+
+def run_validation(args, candidate:dict, stages=BENCH_STAGES, n_runs=20, n_points=10, alpha=0.01, verbose=True) -> dict:
+    """
+    Run the reference (object engine) and the candidate (args overrides, e.g.
+    {"engine": "vector"}) n_runs times each for every (first, second) stage
+    pair. The two engines get disjoint SeedSequence children of args.rnd_seed:
+    with the same seeds, they would draw the same initial opinions, and the
+    samples would not be independent as the KS test assumes.
+    Return {"meta", "candidate", "passed", "speedup", "cases"}.
+    """
+    # warm up (imports, numba compilation) outside of the timed runs
+    first, second = stages[0]
+    warmup_args = ArgsConfig.set_config_second(ArgsConfig.set_config_first(copy.copy(args), first), second)
+    warmup_args = with_overrides(warmup_args, dict(candidate, N=100, n_steps=5))
+    run_engine(warmup_args, spawn_seeds(args.rnd_seed, 1))
+
+    seeds = spawn_seeds(args.rnd_seed, 2*n_runs)
+    ref_seeds, cand_seeds = seeds[:n_runs], seeds[n_runs:]
+    cases = list()
+    for first, second in stages:
+        ref_args = ArgsConfig.set_config_second(ArgsConfig.set_config_first(copy.copy(args), first), second)
+        ref_args.engine = "object"
+        cand_args = with_overrides(ref_args, candidate)
+        ref, cand = run_engine(ref_args, ref_seeds), run_engine(cand_args, cand_seeds)
+
+        case = compare_runs(ref, cand, n_points=n_points, alpha=alpha)
+        case.update({"first_stage": first, "second_stage": second, "ref_time_s": ref["time_s"],
+                     "cand_time_s": cand["time_s"], "speedup": ref["time_s"] / cand["time_s"]})
+        cases.append(case)
+        if verbose:
+            print("| first {:>2} second {} | {} (min p {:.3g}, threshold {:.2g}) | speedup x{:.2f}".format(
+                first, second, "pass" if case["passed"] else "FAIL", case["min_p"], case["threshold"], case["speedup"]))
+            for test in case["tests"]:
+                if test["p"] < case["threshold"]:
+                    print("|   {}: ref {:.4f} cand {:.4f} (D {:.3f}, p {:.3g})".format(
+                        test["name"], test["ref_mean"], test["cand_mean"], test["D"], test["p"]))
+
+    speedup = sum(case["ref_time_s"] for case in cases) / sum(case["cand_time_s"] for case in cases)
+    return {"meta": get_meta(args), "candidate": candidate, "n_runs": n_runs, "alpha": alpha,
+            "passed": all(case["passed"] for case in cases), "speedup": speedup, "cases": cases}
+
+
+if __name__ == "__main__":
+    parser = ArgsConfig()
+    parser.parser.set_defaults(N=500, n_steps=100)
+    parser.parser.add_argument("--candidate", type=str, default='{"engine": "vector"}',
+        help="(validate) a json dict of the args overrides of the candidate engine.")
+    parser.parser.add_argument("--stages", type=str, default=None,
+        help="(validate) a json list of [first, second] stage pairs; BENCH_STAGES if not given.")
+    parser.parser.add_argument("--n_points", type=int, default=10,
+        help="(validate) the number of steps the curves are compared at.")
+    parser.parser.add_argument("--alpha", type=float, default=0.01,
+        help="(validate) the family-wise significance level of the tests of a stage pair.")
+    parser.parser.add_argument("--out", type=str, default=None,
+        help="(validate) the output json report.")
+    args = parser.parser.parse_args()
+
+    stages = BENCH_STAGES if args.stages is None else [tuple(s) for s in json.loads(args.stages)]
+    res = run_validation(args, json.loads(args.candidate), stages, n_runs=args.n_runs,
+        n_points=args.n_points, alpha=args.alpha)
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(res, f, indent=2)
+        print("report save to {}".format(args.out))
+
+    print("{}: candidate {} (speedup x{:.2f})".format("PASS" if res["passed"] else "FAIL", args.candidate, res["speedup"]))
+    sys.exit(0 if res["passed"] else 1)